@@ -0,0 +1,173 @@
+import json
+
+import numpy as np
+
+# Version 2 added the block properties, magnetization directions and circuit current densities.
+FORMAT_VERSION = 2
+
+
+class Solution:
+    """The mesh and solution read from a FEMM magnetics ``.ans`` file.
+
+        – ``header``: the ``[Key] = value`` entries at the top of the file, e.g. ``header['LengthUnits']``;
+        – ``block_names``: the name of each block property, in the order FEMM numbers them;
+        – ``block_props``: a dict of the properties of each block, e.g. ``{'Mu_x': 1, 'J_re': 0, ...}``, with
+          any B-H curve as a list of ``[B, H]`` pairs under ``'BHPoints'``;
+        – ``nodes``: ``(N, 2)`` array of node coordinates;
+        – ``potential``: ``(N,)`` array of the vector potential at each node, complex if ``Frequency`` is not 0;
+        – ``elements``: ``(M, 3)`` array of the node indices of each triangular element;
+        – ``element_labels``: ``(M,)`` array of the block label index each element belongs to;
+        – ``label_points``: ``(L, 2)`` array of block label coordinates;
+        – ``label_blocks``: ``(L,)`` array of the index into ``block_names`` of each block label;
+        – ``label_groups``: ``(L,)`` array of the group number of each block label;
+        – ``label_mag_directions``: ``(L,)`` array of the magnetization direction of each block label in degrees;
+        – ``label_current_densities``: ``(L,)`` array of the current density in MA/m^2 applied to each block
+          label by its circuit, complex if ``Frequency`` is not 0.
+
+    ``block_props``, ``label_mag_directions`` and ``label_current_densities`` are ``None`` for solutions
+    saved before ``FORMAT_VERSION`` 2."""
+
+    __slots__ = ('header', 'block_names', 'block_props', 'nodes', 'potential', 'elements', 'element_labels',
+                 'label_points', 'label_blocks', 'label_groups', 'label_mag_directions', 'label_current_densities')
+
+    def __init__(self, header, block_names, block_props, nodes, potential, elements, element_labels, label_points,
+                 label_blocks, label_groups, label_mag_directions, label_current_densities):
+        self.header = header
+        self.block_names = block_names
+        self.block_props = block_props
+        self.nodes = nodes
+        self.potential = potential
+        self.elements = elements
+        self.element_labels = element_labels
+        self.label_points = label_points
+        self.label_blocks = label_blocks
+        self.label_groups = label_groups
+        self.label_mag_directions = label_mag_directions
+        self.label_current_densities = label_current_densities
+
+    @property
+    def frequency(self):
+        return float(self.header.get('Frequency', 0))
+
+    @property
+    def element_groups(self):
+        """The group number of each element."""
+
+        return self.label_groups[self.element_labels]
+
+    @property
+    def element_blocks(self):
+        """The index into ``block_names`` of each element."""
+
+        return self.label_blocks[self.element_labels]
+
+    def save(self, path):
+        """Save as a compressed ``.npz`` file, which is roughly a quarter of the size of the ``.ans`` file."""
+
+        np.savez_compressed(
+            path,
+            metadata=np.array(json.dumps({
+                'version': FORMAT_VERSION, **{name: getattr(self, name) for name in self.__slots__[:3]}
+            })),
+            **{name: getattr(self, name) for name in self.__slots__[3:]}
+        )
+
+    @classmethod
+    def load(cls, path):
+        """Load a solution saved with ``save``, by any version."""
+
+        with np.load(path) as data:
+            metadata = json.loads(str(data['metadata']))
+            return cls(*(metadata.get(name) for name in cls.__slots__[:3]),
+                       *(data[name] if name in data else None for name in cls.__slots__[3:]))
+
+
+def _read_table(lines, start, rows):
+    """Read ``rows`` lines of whitespace separated numbers from ``start`` into a 2D array."""
+
+    table_lines = lines[start:start + rows]
+    columns = len(table_lines[0].split()) if rows else 0
+    return np.array(' '.join(table_lines).split(), dtype='float64').reshape(rows, columns)
+
+
+def _parse_value(value):
+    value = value.strip().strip('"')
+    try:
+        return float(value)
+    except ValueError:
+        return value
+
+
+def read_ans(path):
+    """Read a FEMM magnetics solution file into a ``Solution``."""
+
+    with open(path) as f:
+        lines = f.read().splitlines()
+
+    header = {}
+    block_names = []
+    block_props = []
+    label_table = np.zeros((0, 9))
+    in_block = False
+    i = 0
+    while i < len(lines):
+        line = lines[i].strip()
+        i += 1
+        if line.startswith('[Solution]'):
+            break
+        if line.startswith('<BeginBlock>'):
+            block_props.append({})
+            in_block = True
+        elif line.startswith('<EndBlock>'):
+            in_block = False
+        elif line.startswith('<BlockName>'):
+            block_names.append(line.split('=', 1)[1].strip().strip('"'))
+        elif line.startswith('<BHPoints>'):
+            point_count = int(line.split('=', 1)[1])
+            block_props[-1]['BHPoints'] = _read_table(lines, i, point_count).tolist()
+            i += point_count
+        elif line.startswith('<') and in_block:
+            key, _, value = line[1:].partition('>')
+            block_props[-1][key] = _parse_value(value.split('=', 1)[1])
+        elif line.startswith('['):
+            key, _, value = line[1:].partition(']')
+            value = value.split('=', 1)[1].strip().strip('"')
+            if key == 'NumBlockLabels':
+                label_table = _read_table(lines, i, int(value))
+                i += int(value)
+            elif not key.startswith('Num'):
+                header[key] = value
+            else:
+                # Skip the geometry, it is all in the ``.fem`` file.
+                i += int(value)
+
+    node_count = int(lines[i])
+    node_table = _read_table(lines, i + 1, node_count)
+    i += node_count + 1
+    element_count = int(lines[i])
+    element_table = _read_table(lines, i + 1, element_count)
+    i += element_count + 1
+    # Each block label's circuit result, the type of result followed by its real and imaginary parts.
+    circuit_table = _read_table(lines, i + 1, int(lines[i]))
+
+    potential = node_table[:, 2]
+    current_densities = np.where(circuit_table[:, 0] == 1, circuit_table[:, 1], 0)
+    if float(header.get('Frequency', 0)) != 0:
+        potential = potential + 1j * node_table[:, 3]
+        current_densities = current_densities + 1j * np.where(circuit_table[:, 0] == 1, circuit_table[:, 2], 0)
+
+    return Solution(
+        header=header,
+        block_names=block_names,
+        block_props=block_props,
+        nodes=node_table[:, :2].copy(),
+        potential=potential.copy(),
+        elements=element_table[:, :3].astype('int32'),
+        element_labels=element_table[:, 3].astype('int32'),
+        label_points=label_table[:, :2].copy(),
+        # Block types are numbered from 1 in the ``.ans`` file.
+        label_blocks=label_table[:, 2].astype('int32') - 1,
+        label_groups=label_table[:, 6].astype('int32'),
+        label_mag_directions=label_table[:, 5].copy(),
+        label_current_densities=current_densities,
+    )
@@ -0,0 +1,203 @@
+"""Benchmarks for python-femm. Those marked as needing FEMM must be run on Windows with FEMM installed.
+
+Run them with ``python benchmarks.py <benchmark_name>``, or with no name to run them all."""
+
+import functools
+import pickle
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+from scenes import BaseScene, BaseSceneRunner, FaultyScene, ForceYScene
+from transports import NullTransport, ReplayTransport
+
+
+class SyntheticFieldScene(BaseScene):
+    """Returns an array of ``elements`` values per sample, standing in for a per element B field."""
+
+    values = np.arange(1000)
+    elements = 44582
+
+    def run_scene(self, value):
+        b_mag = np.full(self.elements, value, dtype='float64')
+        if self.result_schema is not None:
+            self.output['b_mag'][...] = b_mag
+            return None
+        return b_mag
+
+
+class SharedSyntheticFieldScene(SyntheticFieldScene):
+
+    result_schema = {'b_mag': ((SyntheticFieldScene.elements,), 'float64')}
+
+
+def benchmark_result_transport(processes=4):
+    """Compare returning 1000 per element field arrays through shared memory with pickling them."""
+
+    for scene_class in (SyntheticFieldScene, SharedSyntheticFieldScene):
+        runner = BaseSceneRunner(scene_class=scene_class, processes=processes)
+        start_time = time.perf_counter()
+        results = runner.run_jobs(runner.scene_class.values)
+        duration = time.perf_counter() - start_time
+        pickled_bytes = sum(len(pickle.dumps(result.result)) for result in results)
+        shared_bytes = runner.buffers.nbytes if runner.buffers is not None else 0
+        print(f'{scene_class.__name__}: {duration:.2f} s, {pickled_bytes / 1e6:.1f} MB pickled, '
+              f'{shared_bytes / 1e6:.1f} MB shared')
+        runner.results = results
+        runner.close()
+
+
+def benchmark_execution_profiles(samples=5):
+    """Time ``model.Runner`` per sample under each execution profile (needs FEMM)."""
+
+    from model import Runner
+    from wrapper import EXECUTION_PROFILES
+
+    for profile in EXECUTION_PROFILES:
+        runner = Runner(profile=profile)
+        runner.start()
+        start_time = time.perf_counter()
+        for _ in range(samples):
+            runner.pre()
+            runner.solve()
+            runner.post()
+            runner.session.post.close()
+            runner.close()
+        duration = (time.perf_counter() - start_time) / samples
+        runner.session.quit()
+        print(f'{profile}: {duration:.3f} s per sample')
+        slowest = sorted(runner.session.command_timings.items(), key=lambda item: item[1], reverse=True)[:5]
+        for command_name, command_time in slowest:
+            print(f'    {command_name}: {command_time / samples:.3f} s per sample')
+
+
+def benchmark_scene_replay(trace_path='traces/force_y.jsonl', processes=4):
+    """Run ``ForceYScene`` against a recorded trace, taking as long as FEMM did for each command.
+    Record the trace on a machine with FEMM by setting ``ForceYScene.transport`` to
+    ``functools.partial(RecordingTransport, 'traces/force_y_{pid}.jsonl')`` and combining the files."""
+
+    runner = BaseSceneRunner(scene_class=ForceYScene, processes=processes)
+    runner.scene_class.transport = functools.partial(ReplayTransport, trace_path, use_latency=True)
+    start_time = time.perf_counter()
+    results = runner.run_jobs(runner.scene_class.values)
+    duration = time.perf_counter() - start_time
+    failures = len([result for result in results if not result.ok])
+    print(f'{len(results)} values in {duration:.2f} s on {processes} processes with {failures} failures')
+
+
+def benchmark_wrapper(samples=200, calls=20000):
+    """Time the wrapper's own overhead, with a transport that answers every command at once: building
+    ``model.Runner``'s geometry, and sending single commands through the compiled command methods and
+    through ``call_femm_with_args``."""
+
+    from model import Runner
+    from wrapper import FEMMSession
+
+    session = FEMMSession(profile='batch', transport=NullTransport())
+    runner = Runner(session=session)
+    start_time = time.perf_counter()
+    for _ in range(samples):
+        runner.pre()
+    print(f'model.Runner.pre: {(time.perf_counter() - start_time) / samples * 1e3:.2f} ms')
+
+    commands = {
+        'add_node': lambda: session.pre.add_node(points=[[1.5, 2.5]]),
+        'set_block_prop': lambda: session.pre.set_block_prop(block_name='Air', auto_mesh=True, group=1),
+        'get_point_values': lambda: session.post.get_point_values(1.5, 2.5),
+        'call_femm_with_args': lambda: session.call_femm_with_args('i_addnode', 1.5, 2.5),
+    }
+    for name, command in commands.items():
+        start_time = time.perf_counter()
+        for _ in range(calls):
+            command()
+        print(f'{name}: {(time.perf_counter() - start_time) / calls * 1e6:.2f} µs per call')
+
+
+def benchmark_geometry(entities=100000):
+    """Time drawing a polygon of ``entities`` nodes and segments, with a transport that answers every
+    command at once, one point at a time and with the bulk ``add_nodes`` and ``add_segments``."""
+
+    from wrapper import FEMMSession
+
+    transport = NullTransport()
+    session = FEMMSession(profile='batch', transport=transport)
+    session.set_mode(0)
+    angles = np.linspace(0, 2 * np.pi, entities, endpoint=False)
+    xy = np.column_stack([np.cos(angles), np.sin(angles)]) * 100
+
+    start_time = time.perf_counter()
+    for _ in range(2 * entities):
+        transport.mlab2femm('mi_addnode(1.0, 2.0)')
+    transport_duration = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    for i in range(entities):
+        session.pre.add_node(points=[xy[i]])
+        session.pre.add_segment(points=[xy[i], xy[(i + 1) % entities]])
+    print(f'add_node and add_segment: {time.perf_counter() - start_time:.2f} s')
+
+    start_time = time.perf_counter()
+    indices = session.pre.add_nodes(xy)
+    session.pre.add_segments(np.column_stack([indices, np.roll(indices, -1)]))
+    print(f'add_nodes and add_segments: {time.perf_counter() - start_time:.2f} s')
+    print(f'transport alone: {transport_duration:.2f} s')
+
+
+def benchmark_startup(repeats=5, processes=4):
+    """Time starting ``python manage.py`` and importing the modules that its commands need, each in a
+    fresh interpreter, and how long spawned scene workers take to be ready for their first job."""
+
+    def median_duration(args):
+        durations = []
+        for _ in range(repeats):
+            start_time = time.perf_counter()
+            subprocess.run([sys.executable, *args], check=True, stdout=subprocess.DEVNULL)
+            durations.append(time.perf_counter() - start_time)
+        return sorted(durations)[len(durations) // 2]
+
+    print(f'python: {median_duration(["-c", "pass"]):.3f} s')
+    print(f'manage.py --help: {median_duration(["manage.py", "--help"]):.3f} s')
+    for module_name in ('run', 'scenes', 'distributed', 'store', 'fields'):
+        print(f'import {module_name}: {median_duration(["-c", f"import {module_name}"]):.3f} s')
+
+    runner = BaseSceneRunner(scene_class=FaultyScene, processes=processes)
+    runner.scene_class.hang_rate = runner.scene_class.crash_rate = runner.scene_class.error_rate = 0
+    runner.scene_class.duration = 0
+    runner.run_jobs(range(processes))
+    print(f'scene worker: {np.median(runner.worker_start_times):.3f} s from spawn to ready')
+
+
+def benchmark_fault_tolerance(processes=4, timeout=1):
+    """Compare the throughput of ``FaultyScene`` with no failures and with its default rates of hung,
+    crashed and raising workers, each of which costs a replacement worker and a retry."""
+
+    for failing in (False, True):
+        runner = BaseSceneRunner(scene_class=FaultyScene, processes=processes, timeout=timeout)
+        if not failing:
+            runner.scene_class.hang_rate = runner.scene_class.crash_rate = runner.scene_class.error_rate = 0
+        start_time = time.perf_counter()
+        results = runner.run_jobs(runner.scene_class.values)
+        duration = time.perf_counter() - start_time
+        retries = sum(result.attempts - 1 for result in results)
+        failures = len([result for result in results if not result.ok])
+        print(f'{"with" if failing else "without"} failures: {len(results) / duration:.1f} values per second, '
+              f'{retries} retries, {failures} failed')
+
+
+BENCHMARKS = {
+    'result_transport': benchmark_result_transport,
+    'execution_profiles': benchmark_execution_profiles,
+    'scene_replay': benchmark_scene_replay,
+    'wrapper': benchmark_wrapper,
+    'geometry': benchmark_geometry,
+    'startup': benchmark_startup,
+    'fault_tolerance': benchmark_fault_tolerance,
+}
+
+if __name__ == '__main__':
+    names = sys.argv[1:] or list(BENCHMARKS)
+    for name in names:
+        print(f'Running {name}...')
+        BENCHMARKS[name]()
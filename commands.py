@@ -0,0 +1,399 @@
+"""The FEMM commands sent by ``PreprocessorAPI`` and ``PostProcessorAPI``, declared as tables.
+
+Each ``Command`` names a FEMM command without its prefix, e.g. ``'addnode'`` for ``mi_addnode``, and
+lists its parameters as ``(name, kind, default)``, where ``kind`` is one of ``NUMBER``, ``STRING``,
+``BOOL`` or ``VALUE`` and the default may be ``REQUIRED``. Commands whose arguments differ between
+magnetics, electrostatics, heat and current flow problems give the parameters used by each in
+``variants``, e.g. ``{'m': ('block_name', ...), 'ehc': (...)}``.
+
+When an API class is created the table is compiled into one encoder function per command and mode,
+which formats a complete command string with a single f-string, and commands with a ``method`` are
+added to the class as methods with the same signature."""
+
+NUMBER = 'number'
+STRING = 'string'
+BOOL = 'bool'
+VALUE = 'value'
+
+MODES = 'mehc'
+
+
+class _Required:
+    def __repr__(self):
+        return 'REQUIRED'
+
+
+REQUIRED = _Required()
+
+
+def encode_value(value):
+    """Encode an argument of any type, as ``FEMMSession._parse_args`` does."""
+
+    if isinstance(value, str):
+        return f'"{value}"'
+    if isinstance(value, bool):
+        return '1' if value else '0'
+    if value is None:
+        return '"<None>"'
+    return str(value)
+
+
+def encode_number(value):
+    if value is None:
+        return '"<None>"'
+    if value is True:
+        return '1'
+    if value is False:
+        return '0'
+    return str(value)
+
+
+def encode_string(value):
+    return '"<None>"' if value is None else f'"{value}"'
+
+
+def encode_bool(value):
+    return '1' if value else '0'
+
+
+ENCODERS = {
+    NUMBER: encode_number,
+    STRING: encode_string,
+    BOOL: encode_bool,
+    VALUE: encode_value,
+}
+
+
+class Command:
+    """A FEMM command, see the module docstring. ``decode`` is set for commands that return values,
+    ``view`` for commands that only change the view and are skipped by profiles with
+    ``skip_view_commands``, and ``doc`` is the docstring of the generated ``method``."""
+
+    __slots__ = ('name', 'method', 'parameters', 'variants', 'decode', 'view', 'doc', 'encoders')
+
+    def __init__(self, name, method=None, parameters=(), variants=None, decode=False, view=False, doc=None):
+        self.name = name
+        self.method = method
+        self.parameters = tuple(parameters)
+        self.variants = variants or {MODES: tuple(parameter[0] for parameter in self.parameters)}
+        self.decode = decode
+        self.view = view
+        self.doc = doc
+        self.encoders = {}
+
+    def _signature(self):
+        return ', '.join(
+            name if default is REQUIRED else f'{name}={default!r}' for name, _, default in self.parameters
+        )
+
+    def compile(self, suffix):
+        """Compile an encoder for every mode, e.g. ``encoders['m'](x, y)`` returns ``'mi_addnode(x, y)'``
+        for ``suffix`` ``'i'``. Each encoder takes every parameter and ignores the ones that its mode
+        does not use."""
+
+        kinds = {name: kind for name, kind, _ in self.parameters}
+        namespace = {f'encode_{kind}': encoder for kind, encoder in ENCODERS.items()}
+        for modes, names in self.variants.items():
+            arguments = ', '.join(f'{{encode_{kinds[name]}({name})}}' for name in names)
+            for mode in modes:
+                source = f"def encode({self._signature()}):\n    return f'{mode}{suffix}_{self.name}({arguments})'\n"
+                exec(source, namespace)
+                self.encoders[mode] = namespace['encode']
+        for mode in MODES:
+            if mode not in self.encoders:
+                self.encoders[mode] = self._unsupported(f'{mode}{suffix}_{self.name}')
+
+    @staticmethod
+    def _unsupported(command_name):
+        def encode(*args, **kwargs):
+            raise ValueError(f'{command_name} is not a FEMM command.')
+        return encode
+
+    def method_source(self):
+        """The source of the API method that sends this command."""
+
+        names = ', '.join(name for name, _, _ in self.parameters)
+        signature = f'self, {self._signature()}' if self.parameters else 'self'
+        lines = [f'def {self.method}({signature}):']
+        if self.view:
+            lines.append("    if self.session.profile['skip_view_commands']:")
+            lines.append('        return None')
+        lines.append(f'    return self.session.send(encoders[self.session.doctype_prefix]({names}), {self.decode})')
+        return '\n'.join(lines) + '\n'
+
+
+def add_commands(cls, commands, suffix):
+    """Compile ``commands`` and add them to the API class ``cls`` as ``cls.commands``, adding a method
+    for each command that has one."""
+
+    cls.commands = {}
+    for command in commands:
+        command.compile(suffix)
+        cls.commands[command.name] = command
+        if command.method is None:
+            continue
+        namespace = {'encoders': command.encoders}
+        exec(command.method_source(), namespace)
+        method = namespace[command.method]
+        method.__doc__ = command.doc
+        method.__qualname__ = f'{cls.__name__}.{command.method}'
+        method.__module__ = cls.__module__
+        setattr(cls, command.method, method)
+    return cls
+
+
+_POINT = (('x', NUMBER, REQUIRED), ('y', NUMBER, REQUIRED))
+_LINE = (('x1', NUMBER, REQUIRED), ('y1', NUMBER, REQUIRED), ('x2', NUMBER, REQUIRED), ('y2', NUMBER, REQUIRED))
+
+PREPROCESSOR_COMMANDS = [
+    Command('close', 'close', doc='Closes current preprocessor document and destroys preprocessor window.'),
+
+    # Object Add/Remove Commands
+    Command('addnode', parameters=_POINT),
+    Command('addsegment', parameters=_LINE),
+    Command('addblocklabel', parameters=_POINT),
+    Command('addarc', parameters=_LINE + (('angle', NUMBER, REQUIRED), ('max_seg', NUMBER, REQUIRED))),
+    Command('deleteselected', 'delete_selected', doc='Delete all selected objects.'),
+    Command('deleteselectednodes', 'delete_selected_nodes', doc='Delete selected nodes.'),
+    Command('deleteselectedlabels', 'delete_selected_labels', doc='Delete selected labels.'),
+    Command('deleteselectedsegments', 'delete_selected_segments', doc='Delete selected segments.'),
+    Command('deleteselectedarcsegments', 'delete_selected_arc_segments', doc='Delete selected arc segments.'),
+
+    # Geometry Selection Commands
+    Command('clearselected', 'clear_selected', doc='Clear all selected nodes, blocks, segments and arc segments.'),
+    Command('selectsegment', parameters=_POINT),
+    Command('selectnode', parameters=_POINT),
+    Command('selectlabel', parameters=_POINT),
+    Command('selectarcsegment', parameters=_POINT),
+    Command('selectgroup', 'select_group', [('group', NUMBER, REQUIRED)], doc=(
+        'Select the nth group of nodes, segments, arc segments and blocklabels. This function will clear '
+        'all previously selected elements and leave the editmode in 4 (group).'
+    )),
+
+    # Object Labeling Commands
+    Command('setnodeprop', 'set_node_prop', [
+        ('prop_name', STRING, None),
+        ('group', NUMBER, None),
+        ('in_conductor', STRING, None),
+    ], variants={
+        'm': ('prop_name', 'group'),
+        'ehc': ('prop_name', 'group', 'in_conductor'),
+    }, doc=(
+        'Set the selected nodes to have the nodal property ``prop_name`` and group ``group``. '
+        'Other than in magnetics problems the nodes are part of the conductor ``in_conductor``.'
+    )),
+    Command('setblockprop', 'set_block_prop', [
+        ('block_name', STRING, None),
+        ('auto_mesh', BOOL, False),
+        ('mesh_size', NUMBER, None),
+        ('in_circuit', STRING, None),
+        ('mag_direction', VALUE, False),
+        ('group', NUMBER, None),
+        ('turns', NUMBER, None),
+    ], variants={
+        'm': ('block_name', 'auto_mesh', 'mesh_size', 'in_circuit', 'mag_direction', 'group', 'turns'),
+        'ehc': ('block_name', 'auto_mesh', 'mesh_size', 'group'),
+    }, doc="""Set the selected block labels to have the properties:
+
+            – Block property ``block_name``;
+            – ``auto_mesh``: ``False`` = mesher defers to mesh size constraint defined in ``mesh_size``,
+              ``True`` = mesher automatically chooses the mesh density;
+            – ``mesh_size``: size constraint on the mesh in the block marked by this label;
+            – Block is a member of the circuit named ``in_circuit``;
+            – The magnetization is directed along an angle in measured in degrees denoted by the
+              parameter ``mag_direction``. Alternatively, ``mag_direction`` can be a string containing a
+              formula that prescribes the magnetization direction as a function of element position.
+              In this formula theta and R denotes the angle in degrees of a line connecting the center
+              each element with the origin and the length of this line, respectively; x and y denote
+              the x- and y-position of the center of the each element. For axisymmetric problems, r
+              and z should be used in place of x and y;
+            – A member of group number group;
+            – The number of turns associated with this label is denoted by turns.
+
+        Only ``block_name``, ``auto_mesh``, ``mesh_size`` and ``group`` are used other than in magnetics problems."""),
+    Command('setsegmentprop', 'set_segment_prop', [
+        ('prop_name', STRING, None),
+        ('element_size', NUMBER, None),
+        ('auto_mesh', BOOL, False),
+        ('hide', BOOL, False),
+        ('group', NUMBER, None),
+        ('in_conductor', STRING, None),
+    ], variants={
+        'm': ('prop_name', 'element_size', 'auto_mesh', 'hide', 'group'),
+        'ehc': ('prop_name', 'element_size', 'auto_mesh', 'hide', 'group', 'in_conductor'),
+    }, doc="""Set the select segments to have:
+
+            – Boundary property ``prop_name``;
+            – Local element size along segment no greater than ``element_size``;
+            – ``auto_mesh``: ``False`` = mesher defers to the element constraint defined by element_size,
+              ``True`` = mesher automatically chooses mesh size along the selected segments;
+            – ``hide``: ``False`` = not hidden in post-processor, ``True`` = hidden in post-processor;
+            – A member of group number group;
+            – Other than in magnetics problems, part of the conductor ``in_conductor``."""),
+    Command('setarcsegmentprop', 'set_arc_segment_prop', [
+        ('max_seg_deg', NUMBER, None),
+        ('prop_name', STRING, None),
+        ('hide', BOOL, False),
+        ('group', NUMBER, None),
+        ('in_conductor', STRING, None),
+    ], variants={
+        'm': ('max_seg_deg', 'prop_name', 'hide', 'group'),
+        'ehc': ('max_seg_deg', 'prop_name', 'hide', 'group', 'in_conductor'),
+    }, doc="""Set the selected arc segments to have:
+
+            – Arcs discretized into segments of no more than ``max_seg_deg`` degrees;
+            – Boundary property ``prop_name``;
+            – ``hide``: ``False`` = not hidden in post-processor, ``True`` == hidden in post-processor;
+            – A member of group number ``group``;
+            – Other than in magnetics problems, part of the conductor ``in_conductor``."""),
+    Command('setgroup', 'set_group', [('group', NUMBER, REQUIRED)],
+            doc='Set the group associated of the selected items to ``group``.'),
+
+    # Problem Commands
+    Command('probdef', parameters=[
+        ('frequency', NUMBER, None),
+        ('units', STRING, None),
+        ('problem_type', STRING, None),
+        ('precision', NUMBER, None),
+        ('depth', NUMBER, None),
+        ('minimum_angle', NUMBER, None),
+        ('ac_solver', NUMBER, None),
+        ('previous_solution', STRING, None),
+        ('time_step', NUMBER, None),
+    ], variants={
+        'm': ('frequency', 'units', 'problem_type', 'precision', 'depth', 'minimum_angle', 'ac_solver'),
+        'e': ('units', 'problem_type', 'precision', 'depth', 'minimum_angle'),
+        'h': ('units', 'problem_type', 'precision', 'depth', 'minimum_angle', 'previous_solution', 'time_step'),
+        'c': ('units', 'problem_type', 'frequency', 'precision', 'depth', 'minimum_angle'),
+    }),
+    Command('analyze', parameters=[('flag', NUMBER, 0)]),
+    Command('loadsolution', 'load_solution', doc='Loads and displays the solution corresponding to the current geometry.'),
+    Command('saveas', parameters=[('filename', STRING, REQUIRED)]),
+
+    # Mesh Commands
+    Command('createmesh', 'create_mesh', doc=(
+        'Runs triangle to create a mesh. Note that this is not a necessary precursor of performing an '
+        'analysis, as analyze() will make sure the mesh is up to date before running an analysis.'
+    )),
+    Command('showmesh', 'show_mesh', view=True, doc='Shows the mesh.'),
+
+    # Zoom Commands
+    Command('zoomnatural', 'zoom_natural', view=True, doc='Zooms to a “natural” view with sensible extents.'),
+    Command('zoomout', 'zoom_out', view=True, doc='Zoom out by a factor of 50%.'),
+    Command('zoomin', 'zoom_in', view=True, doc='Zoom in by a factor of 200%.'),
+    Command('zoom', 'zoom', _LINE, view=True, doc=(
+        'Set the display area to be from the bottom left corner specified by (x1, y1) to the top right '
+        'corner specified by (x2, y2).'
+    )),
+
+    # Object Properties
+    Command('getmaterial', 'get_material', [('material_name', STRING, REQUIRED)],
+            doc='Fetches the material specified by ``material_name`` from materials library.'),
+    Command('addmaterial', parameters=[
+        ('material_name', STRING, REQUIRED),
+        ('mu_x', NUMBER, None),
+        ('mu_y', NUMBER, None),
+        ('h_c', NUMBER, None),
+        ('j', NUMBER, None),
+        ('c_duct', NUMBER, None),
+        ('lam_d', NUMBER, None),
+        ('phi_hmax', NUMBER, None),
+        ('lam_fill', NUMBER, None),
+        ('lam_type', NUMBER, None),
+        ('phi_hx', NUMBER, None),
+        ('phi_hy', NUMBER, None),
+        ('number_of_strands', NUMBER, None),
+        ('wire_diameter', NUMBER, None),
+        ('e_x', NUMBER, None),
+        ('e_y', NUMBER, None),
+        ('q_v', NUMBER, None),
+        ('k_x', NUMBER, None),
+        ('k_y', NUMBER, None),
+        ('k_t', NUMBER, None),
+        ('o_x', NUMBER, None),
+        ('o_y', NUMBER, None),
+        ('lt_x', NUMBER, None),
+        ('lt_y', NUMBER, None),
+    ], variants={
+        'm': ('material_name', 'mu_x', 'mu_y', 'h_c', 'j', 'c_duct', 'lam_d', 'phi_hmax', 'lam_fill', 'lam_type',
+              'phi_hx', 'phi_hy', 'number_of_strands', 'wire_diameter'),
+        'e': ('material_name', 'e_x', 'e_y', 'q_v'),
+        'h': ('material_name', 'k_x', 'k_y', 'q_v', 'k_t'),
+        'c': ('material_name', 'o_x', 'o_y', 'e_x', 'e_y', 'lt_x', 'lt_y'),
+    }),
+    Command('addcircprop', parameters=[
+        ('circuit_name', STRING, None),
+        ('current', NUMBER, None),
+        ('circuit_type', NUMBER, 0),
+    ], variants={'m': ('circuit_name', 'current', 'circuit_type')}),
+    Command('modifypointprop', 'modify_point_prop', [
+        ('point_name', STRING, None),
+        ('prop_number', NUMBER, None),
+        ('value', VALUE, None),
+    ], doc=(
+        'This function allows for modification of a point property. The point property to be modified is '
+        'specified by ``point_name``. The next parameter is the number of the property to be set. The last '
+        'number is the value to be applied to the specified property. The various properties that can be '
+        'modified in magnetics problems are listed below: 0: PointName, 1: A or 2: J.'
+    )),
+    Command('modifycircprop', 'modify_circuit_prop', [
+        ('circuit_name', STRING, None),
+        ('prop_number', NUMBER, None),
+        ('value', VALUE, None),
+    ], variants={'m': ('circuit_name', 'prop_number', 'value')}, doc=(
+        'This function allows for modification of a circuit property. The circuit property to be modified is '
+        'specified by ``circuit_name``. The next parameter is the number of the property to be set. The last '
+        'number is the value to be applied to the specified property. The various properties that can be '
+        'modified are listed below: 0: CircName, 1: i or 2: CircType.'
+    )),
+    Command('setcurrent', 'set_current', [
+        ('circuit_name', STRING, None),
+        ('current', NUMBER, None),
+    ], variants={'m': ('circuit_name', 'current')}),
+
+    # Miscellaneous
+    Command('makeABC', parameters=[
+        ('number_of_shells', NUMBER, REQUIRED),
+        ('radius', NUMBER, REQUIRED),
+        ('x', NUMBER, REQUIRED),
+        ('y', NUMBER, REQUIRED),
+        ('boundary_condition_type', NUMBER, REQUIRED),
+    ]),
+]
+
+POSTPROCESSOR_COMMANDS = [
+    Command('close', 'close', doc='Close the current postprocessor window and document.'),
+    Command('lineintegral', 'line_integral', [('integral_type', NUMBER, REQUIRED)], decode=True, doc=(
+        'Calculate the line integral for the defined contour. Returns typically two (possibly complex) '
+        'values as results.'
+    )),
+    Command('blockintegral', 'block_integral', [('integral_type', NUMBER, REQUIRED)], decode=True, doc=(
+        'Calculate a block integral for the selected blocks. This function returns one (possibly complex) '
+        'value, e.g.: volume = mo_blockintegral(10).'
+    )),
+    Command('getpointvalues', 'get_point_values', _POINT, decode=True,
+            doc='Get the values associated with the point at x,y return values in order'),
+
+    # Selection Commands.
+    Command('seteditmode', 'set_edit_mode', [('mode', STRING, REQUIRED)], doc=(
+        'Sets the mode of the postprocessor to point, contour, or area mode. Valid entries for mode are '
+        '"point", "contour", and "area".'
+    )),
+    Command('selectblock', parameters=_POINT),
+    Command('groupselectblock', 'group_select_block', [('group', NUMBER, None)], doc=(
+        'Selects all of the blocks that are labeled by block labels that are members of group n. If no '
+        'number is specified (i.e. mo_groupselectblock()), all blocks are selected.'
+    )),
+
+    # View Commands.
+    Command('showdensityplot', parameters=[
+        ('legend', NUMBER, None),
+        ('grey_scale', NUMBER, None),
+        ('upper_bound', NUMBER, None),
+        ('lower_bound', NUMBER, None),
+        ('plot_type', STRING, None),
+    ], variants={
+        'm': ('legend', 'grey_scale', 'upper_bound', 'lower_bound', 'plot_type'),
+        'ehc': ('legend', 'grey_scale', 'plot_type', 'upper_bound', 'lower_bound'),
+    }),
+]
@@ -0,0 +1,208 @@
+"""Sweep-wide field datasets built from many ``.ans`` solutions at once, without FEMM.
+
+``build_dataset`` reads the solutions across a pool of processes and streams one row per solution
+into a memory-mapped ``.npy`` file, so that datasets larger than memory can be built and then
+sliced, e.g. ``Dataset('b_profile').values[:, 10:20]``. Each row holds either a value per node or
+element of the mesh, which every solution must then share, or the values at a set of probe points.
+
+Probe points are located in each mesh once. Solutions with the same mesh as one already located
+by the same process only have their solution vector interpolated."""
+
+import hashlib
+import json
+import multiprocessing as mp
+import os
+from multiprocessing.util import Finalize
+
+import numpy as np
+
+from ans import read_ans
+
+QUANTITIES = ('potential', 'bmag', 'breal', 'bimag', 'hmag', 'hreal', 'himag', 'jmag', 'jreal', 'jimag')
+
+
+def mesh_key(solution):
+    """A hash of the node coordinates and elements of a solution, equal for identical meshes."""
+
+    return hashlib.sha1(solution.nodes.tobytes() + solution.elements.tobytes()).hexdigest()
+
+
+class MeshIndex:
+    """The element containing each of ``points``, ``(P, 2)``, in a solution's mesh and the
+    barycentric weights of each point's position in it. Points outside the mesh get NaN."""
+
+    def __init__(self, solution, points):
+        from matplotlib.tri import Triangulation
+
+        triangulation = Triangulation(solution.nodes[:, 0], solution.nodes[:, 1], solution.elements)
+        self.element_indices = triangulation.get_trifinder()(points[:, 0], points[:, 1])
+        self.inside = self.element_indices >= 0
+        corners = solution.nodes[solution.elements[self.element_indices]]
+        # Solve p = c0 + w1 (c1 - c0) + w2 (c2 - c0) for each point.
+        edges = np.stack([corners[:, 1] - corners[:, 0], corners[:, 2] - corners[:, 0]], axis=2)
+        edges[~self.inside] = np.eye(2)
+        w = np.linalg.solve(edges, (points - corners[:, 0])[:, :, None])[:, :, 0]
+        self.weights = np.column_stack([1 - w.sum(axis=1), w])
+
+    def interpolate_nodes(self, solution, values):
+        """Linearly interpolate per node ``values`` at the points."""
+
+        corner_values = values[solution.elements[self.element_indices]]
+        return np.where(self.inside, np.sum(corner_values * self.weights, axis=1), np.nan)
+
+    def interpolate_elements(self, values):
+        """Take the value of the element containing each point, for quantities that are constant over
+        each element, such as B."""
+
+        return np.where(self.inside, values[self.element_indices], np.nan)
+
+
+def _sample(solution, quantity, index=None):
+    """Return the values of ``quantity`` for a solution, at the points of ``index`` if it is given."""
+
+    if quantity == 'potential':
+        values = solution.potential
+        return values if index is None else index.interpolate_nodes(solution, values)
+    from fields import element_field
+    values = element_field(solution, quantity)
+    return values if index is None else index.interpolate_elements(values)
+
+
+# Set in each worker process by ``_init_worker``.
+_worker = {}
+
+
+def _init_worker(values_path, quantity, points, required_mesh_key):
+    _worker['values'] = np.load(values_path, mmap_mode='r+')
+    # Flushing every row would write back the whole mapping each time, so only flush as the worker exits.
+    Finalize(_worker['values'], _worker['values'].flush, exitpriority=0)
+    _worker['quantity'] = quantity
+    _worker['points'] = points
+    _worker['required_mesh_key'] = required_mesh_key
+    _worker['indexes'] = {}
+
+
+def _ingest(job):
+    """Read one solution into its row of the dataset. Returns the row, the solution's mesh key and an
+    error message if it failed, in which case the row is filled with NaN."""
+
+    row, path = job
+    values = _worker['values']
+    key = None
+    try:
+        solution = read_ans(path)
+        key = mesh_key(solution)
+        if _worker['points'] is None:
+            if key != _worker['required_mesh_key']:
+                raise ValueError('The mesh differs from the first solution, so probe points are needed.')
+            values[row] = _sample(solution, _worker['quantity'])
+        else:
+            if key not in _worker['indexes']:
+                _worker['indexes'][key] = MeshIndex(solution, _worker['points'])
+            values[row] = _sample(solution, _worker['quantity'], _worker['indexes'][key])
+        error = None
+    except Exception as e:
+        values[row] = np.nan
+        error = repr(e)
+    return row, key, error
+
+
+class Dataset:
+    """A dataset written by ``build_dataset`` to ``directory``:
+
+        – ``values``: ``(samples, P)`` read-only memory-mapped array, one row per solution;
+        – ``paths``: the solution each row was read from;
+        – ``quantity``: ``'potential'`` or one of ``fields.PLOT_TYPES``;
+        – ``points``: the ``(P, 2)`` probe points, or ``None`` if each row has a value per node or element;
+        – ``mesh_keys``: the ``mesh_key`` of each solution, ``None`` where it could not be read;
+        – ``errors``: ``{row: error}`` for each solution that could not be read, its row is NaN;
+        – ``nodes``, ``elements``: the mesh of the first solution that could be read, which every row
+          shares if there are no probe points."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        with open(os.path.join(directory, 'dataset.json')) as f:
+            metadata = json.load(f)
+        self.paths = metadata['paths']
+        self.quantity = metadata['quantity']
+        self.mesh_keys = metadata['mesh_keys']
+        self.errors = {int(row): error for row, error in metadata['errors'].items()}
+        self.values = np.load(os.path.join(directory, 'values.npy'), mmap_mode='r')
+        self.points = np.load(os.path.join(directory, 'points.npy')) if metadata['has_points'] else None
+        with np.load(os.path.join(directory, 'mesh.npz')) as mesh:
+            self.nodes = mesh['nodes']
+            self.elements = mesh['elements']
+
+    def __len__(self):
+        return len(self.values)
+
+    @property
+    def shared_mesh(self):
+        """Whether every solution that was read has the same mesh."""
+
+        return len({key for key in self.mesh_keys if key is not None}) <= 1
+
+
+def build_dataset(solution_paths, directory, quantity='potential', points=None, processes=None, chunk_size=4):
+    """Read each of ``solution_paths`` into a row of a new ``Dataset`` in ``directory``.
+
+    ``quantity`` is ``'potential'``, for the vector potential, or one of FEMM's density plot types,
+    e.g. ``'bmag'``. Without ``points`` each row holds the value at every node (for the potential) or
+    element of the mesh, which every solution must share. With ``points``, an ``(P, 2)`` array, each
+    row holds the values at those points, linearly interpolated for the potential and taken from the
+    containing element otherwise, so the meshes may differ."""
+
+    if quantity not in QUANTITIES:
+        raise ValueError(f'Unknown quantity {quantity!r}, must be one of {QUANTITIES}.')
+    solution_paths = list(solution_paths)
+    if not solution_paths:
+        raise ValueError('No solutions were given.')
+    os.makedirs(directory, exist_ok=True)
+    points = None if points is None else np.asarray(points, dtype='float64').reshape(-1, 2)
+
+    # The first solution that can be read gives the shape and type of each row, and the mesh that is
+    # shared without points. Any before it fail again in the pool, where their error is recorded.
+    for path in solution_paths:
+        try:
+            first = read_ans(path)
+            break
+        except Exception:
+            continue
+    else:
+        raise ValueError('None of the solutions could be read.')
+    first_values = _sample(first, quantity, None if points is None else MeshIndex(first, points))
+    np.savez(os.path.join(directory, 'mesh.npz'), nodes=first.nodes, elements=first.elements)
+    if points is not None:
+        np.save(os.path.join(directory, 'points.npy'), points)
+    values_path = os.path.join(directory, 'values.npy')
+    values = np.lib.format.open_memmap(values_path, mode='w+', dtype=first_values.dtype,
+                                       shape=(len(solution_paths), len(first_values)))
+    del values
+
+    mesh_keys = [None] * len(solution_paths)
+    errors = {}
+    pool = mp.Pool(processes or mp.cpu_count(), initializer=_init_worker,
+                   initargs=(values_path, quantity, points, mesh_key(first)))
+    try:
+        for row, key, error in pool.imap_unordered(_ingest, enumerate(solution_paths), chunksize=chunk_size):
+            mesh_keys[row] = key
+            if error is not None:
+                errors[row] = error
+                print(f'Could not read {solution_paths[row]}: {error}')
+        # Closing rather than terminating lets each worker flush its rows as it exits.
+        pool.close()
+    except BaseException:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+    with open(os.path.join(directory, 'dataset.json'), 'w') as f:
+        json.dump({
+            'paths': solution_paths,
+            'quantity': quantity,
+            'has_points': points is not None,
+            'mesh_keys': mesh_keys,
+            'errors': errors,
+        }, f)
+    return Dataset(directory)
@@ -0,0 +1,364 @@
+"""Run a scene across several machines. A ``JobBroker`` on one machine hands out the scene's values
+to ``WorkerAgent`` processes on any number of machines, which each drive their own FEMM instance and
+send their results back as soon as they finish.
+
+On the machine running the scene::
+
+    broker = JobBroker(ForceYScene.values, address=('0.0.0.0', 6000), authkey=b'secret', timeout=300)
+    for result in broker.results():
+        print(result)
+
+On every solver machine::
+
+    run_agents(ForceYScene, address=('scene-machine', 6000), authkey=b'secret', processes=8)
+
+Every message is unpickled, so ``authkey`` must be given and kept secret from anyone who can reach
+the broker's port.
+
+Agents send a heartbeat every few seconds, if the broker stops hearing from one, or a job runs
+for longer than ``timeout``, its job is handed to another agent and the agent is told to cancel it.
+An agent cancels a job by killing its FEMM instance and exiting, ``run_agents`` then starts a fresh
+one."""
+
+import collections
+import multiprocessing as mp
+import os
+import queue
+import socket
+import threading
+import time
+from multiprocessing.connection import Client, Listener
+
+from scenes import SceneResult
+
+DEFAULT_ADDRESS = ('localhost', 6000)
+
+
+def _require_authkey(authkey):
+    # Connections unpickle every message, so anyone with the key can run code at either end.
+    if not authkey:
+        raise ValueError('An authkey is required, anyone who can connect with it can run code on this machine.')
+    return authkey
+
+
+class _AgentState:
+    """Broker side bookkeeping for a connected agent."""
+
+    def __init__(self, agent_id, connection):
+        self.agent_id = agent_id
+        self.connection = connection
+        self.last_seen = time.monotonic()
+        self.job = None
+        self.attempt = None
+        self.job_started_at = None
+
+
+class JobBroker:
+    """Hands out ``values`` to agents and collects a ``SceneResult`` for each. Jobs whose agent
+    disconnects, stops sending heartbeats for ``heartbeat_timeout`` seconds, runs for longer than
+    ``timeout`` seconds or raises are re-queued up to ``max_retries`` times."""
+
+    poll_interval = 0.1
+    wait_interval = 0.5
+
+    def __init__(self, values, address=DEFAULT_ADDRESS, authkey=None, heartbeat_timeout=30, timeout=None,
+                 max_retries=2):
+        self.values = list(values)
+        self.address = address
+        self.authkey = _require_authkey(authkey)
+        self.heartbeat_timeout = heartbeat_timeout
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.lock = threading.Lock()
+        self.pending = collections.deque(range(len(self.values)))
+        self.scene_results = [SceneResult(value) for value in self.values]
+        self.finished = queue.Queue()
+        self.agents = {}
+        self.done = False
+
+    def _send(self, agent, message):
+        try:
+            agent.connection.send(message)
+        except (OSError, EOFError):
+            pass
+
+    def _accept(self, listener):
+        while not self.done:
+            try:
+                connection = listener.accept()
+            except (OSError, EOFError, mp.AuthenticationError):
+                # Raised for failed authentication as well as when the listener is closed.
+                continue
+            threading.Thread(target=self._serve, args=(connection,), daemon=True).start()
+
+    def _serve(self, connection):
+        try:
+            _, agent_id = connection.recv()
+        except (OSError, EOFError):
+            return
+        agent = _AgentState(agent_id, connection)
+        with self.lock:
+            self.agents[agent_id] = agent
+        try:
+            while True:
+                message = connection.recv()
+                with self.lock:
+                    agent.last_seen = time.monotonic()
+                    kind = message[0]
+                    if kind == 'request':
+                        self._assign(agent)
+                    elif kind == 'result':
+                        self._complete(agent, *message[1:])
+        except (OSError, EOFError):
+            pass
+        finally:
+            with self.lock:
+                if agent.job is not None:
+                    self._retry(agent, 'agent disconnected')
+                self.agents.pop(agent_id, None)
+            connection.close()
+
+    def _assign(self, agent):
+        if self.done:
+            self._send(agent, ('stop',))
+        elif self.pending:
+            agent.job = self.pending.popleft()
+            result = self.scene_results[agent.job]
+            result.attempts += 1
+            agent.attempt = result.attempts
+            agent.job_started_at = time.monotonic()
+            self._send(agent, ('job', agent.job, agent.attempt, self.values[agent.job]))
+        else:
+            # Jobs may yet be re-queued, so keep the agent around.
+            self._send(agent, ('wait', self.wait_interval))
+
+    def _complete(self, agent, index, attempt, result, error, duration):
+        if index != agent.job or attempt != agent.attempt:
+            return
+        if error is not None:
+            self._retry(agent, error, duration)
+            return
+        scene_result = self.scene_results[index]
+        scene_result.result = result
+        scene_result.error = None
+        scene_result.duration = duration
+        agent.job = None
+        self.finished.put(scene_result)
+
+    def _retry(self, agent, error, duration=None):
+        index = agent.job
+        agent.job = None
+        scene_result = self.scene_results[index]
+        scene_result.error = error
+        scene_result.duration = duration
+        if scene_result.attempts <= self.max_retries:
+            self.pending.appendleft(index)
+        else:
+            self.finished.put(scene_result)
+
+    def _cancel(self, agent, error, duration=None):
+        # A result for the job may still arrive, it is ignored as the agent no longer has the job.
+        self._send(agent, ('cancel', agent.job, agent.attempt))
+        self._retry(agent, error, duration)
+
+    def _check_agents(self):
+        now = time.monotonic()
+        with self.lock:
+            for agent in self.agents.values():
+                if agent.job is None:
+                    continue
+                if now - agent.last_seen > self.heartbeat_timeout:
+                    self._cancel(agent, 'agent stopped sending heartbeats')
+                elif self.timeout is not None and now - agent.job_started_at > self.timeout:
+                    self._cancel(agent, 'timeout', now - agent.job_started_at)
+
+    def results(self):
+        """Serve the jobs, yielding each ``SceneResult`` as soon as it is finished."""
+
+        listener = Listener(self.address, authkey=self.authkey)
+        threading.Thread(target=self._accept, args=(listener,), daemon=True).start()
+        remaining = len(self.values)
+        try:
+            while remaining:
+                self._check_agents()
+                try:
+                    scene_result = self.finished.get(timeout=self.poll_interval)
+                except queue.Empty:
+                    continue
+                remaining -= 1
+                yield scene_result
+        finally:
+            # Agents are told to stop the next time they ask for a job.
+            self.done = True
+            time.sleep(self.wait_interval * 2)
+            listener.close()
+
+    def run(self):
+        """Serve every job and return the ``SceneResult``s in the same order as ``values``."""
+
+        for _ in self.results():
+            pass
+        return self.scene_results
+
+
+class WorkerAgent:
+    """Connects to a ``JobBroker`` and runs the jobs it is given with a single scene worker. If a job
+    runs for longer than ``timeout``, or the broker cancels it, the agent kills its FEMM instance and
+    exits with a non-zero code, so that ``run_agents`` can start a fresh one.
+
+    The broker is retried for up to ``connect_timeout`` seconds, so agents may be started before it."""
+
+    connect_interval = 1
+
+    def __init__(self, scene_class, address=DEFAULT_ADDRESS, authkey=None, heartbeat_interval=5,
+                 timeout=None, connect_timeout=60):
+        self.scene = scene_class()
+        self.address = address
+        self.authkey = _require_authkey(authkey)
+        self.heartbeat_interval = heartbeat_interval
+        self.timeout = timeout
+        self.connect_timeout = connect_timeout
+        self.agent_id = f'{socket.gethostname()}:{os.getpid()}'
+        self.send_lock = threading.Lock()
+        # Held by whichever thread is reading from the broker, and while ``job`` changes.
+        self.receive_lock = threading.Lock()
+        self.job = None
+        self.job_started_at = None
+        self.femm_process_ids = set()
+
+    def _send(self, connection, message):
+        with self.send_lock:
+            connection.send(message)
+
+    def _connect(self):
+        deadline = time.monotonic() + self.connect_timeout
+        while True:
+            try:
+                return Client(self.address, authkey=self.authkey)
+            except ConnectionRefusedError:
+                if time.monotonic() > deadline:
+                    raise
+                time.sleep(self.connect_interval)
+
+    def _receive(self, connection):
+        """Return the broker's reply to a request, skipping cancellations of jobs that already finished."""
+
+        while True:
+            message = connection.recv()
+            if message[0] != 'cancel':
+                return message
+
+    def _abandon_job(self):
+        self.scene.kill_femm(self.femm_process_ids)
+        os._exit(1)
+
+    def _check_cancelled(self, connection):
+        # While a job runs the only messages the broker can send are cancellations.
+        if not self.receive_lock.acquire(blocking=False):
+            return
+        try:
+            while self.job is not None and connection.poll():
+                message = connection.recv()
+                if message[0] == 'cancel' and tuple(message[1:]) == self.job:
+                    self._abandon_job()
+        finally:
+            self.receive_lock.release()
+
+    def _start_scene(self):
+        existing_process_ids = self.scene.femm_process_ids()
+        self.scene.start_worker()
+        self.femm_process_ids = self.scene.femm_process_ids() - existing_process_ids
+
+    def _finish_job(self):
+        with self.receive_lock:
+            self.job = None
+            self.job_started_at = None
+
+    def _heartbeat(self, connection, stopped):
+        while not stopped.wait(self.heartbeat_interval):
+            job_started_at = self.job_started_at
+            if self.timeout is not None and job_started_at is not None and \
+                    time.monotonic() - job_started_at > self.timeout:
+                self._abandon_job()
+            try:
+                self._check_cancelled(connection)
+                self._send(connection, ('heartbeat',))
+            except (OSError, EOFError):
+                return
+
+    def run(self):
+        connection = self._connect()
+        self._send(connection, ('hello', self.agent_id))
+        self._start_scene()
+        stopped = threading.Event()
+        threading.Thread(target=self._heartbeat, args=(connection, stopped), daemon=True).start()
+        try:
+            while True:
+                with self.receive_lock:
+                    self._send(connection, ('request',))
+                    message = self._receive(connection)
+                    if message[0] == 'job':
+                        _, index, attempt, value = message
+                        self.job = (index, attempt)
+                        self.job_started_at = time.monotonic()
+                if message[0] == 'stop':
+                    break
+                if message[0] == 'wait':
+                    time.sleep(message[1])
+                    continue
+                try:
+                    result = self.scene.run_scene(value)
+                except Exception as e:
+                    duration = time.monotonic() - self.job_started_at
+                    self._finish_job()
+                    self._send(connection, ('result', index, attempt, None, repr(e), duration))
+                    # FEMM may be left in a bad state, so start again with a fresh instance.
+                    self.scene.stop_worker()
+                    self.scene.kill_femm(self.femm_process_ids)
+                    self._start_scene()
+                    continue
+                duration = time.monotonic() - self.job_started_at
+                self._finish_job()
+                self._send(connection, ('result', index, attempt, result, None, duration))
+        except (OSError, EOFError):
+            # The broker has gone away.
+            pass
+        finally:
+            stopped.set()
+            self.scene.stop_worker()
+            connection.close()
+
+
+def _run_agent(scene_class, address, authkey, timeout, connect_timeout, heartbeat_interval):
+    try:
+        WorkerAgent(scene_class, address=address, authkey=authkey, timeout=timeout, connect_timeout=connect_timeout,
+                    heartbeat_interval=heartbeat_interval).run()
+    except ConnectionRefusedError:
+        # The broker did not start within ``connect_timeout``, or it has finished.
+        pass
+
+
+def run_agents(scene_class, address=DEFAULT_ADDRESS, authkey=None, processes=None, timeout=None,
+               connect_timeout=60, heartbeat_interval=5):
+    """Run ``processes`` agents on this machine, restarting any that crash, time out or have their job
+    cancelled, until the broker has no more work. Agents wait up to ``connect_timeout`` seconds for
+    the broker to start listening."""
+
+    _require_authkey(authkey)
+    processes = processes or mp.cpu_count()
+
+    def spawn():
+        process = mp.Process(target=_run_agent, args=(scene_class, address, authkey, timeout, connect_timeout,
+                                                      heartbeat_interval))
+        process.start()
+        return process
+
+    agents = [spawn() for _ in range(processes)]
+    while agents:
+        time.sleep(0.5)
+        for agent in list(agents):
+            if agent.is_alive():
+                continue
+            agents.remove(agent)
+            if agent.exitcode != 0:
+                agents.append(spawn())
@@ -0,0 +1,206 @@
+"""Field quantities and field maps computed from ``.ans`` solutions, without needing FEMM.
+
+Quantities are calculated per element in the same way as FEMM's density plots, so the plot types
+match ``PostProcessorAPI.show_density_plot``, e.g. ``element_field(solution, 'bmag')``."""
+
+import multiprocessing as mp
+import os
+
+import numpy as np
+from matplotlib.animation import FuncAnimation
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+
+from ans import Solution, read_ans
+
+MU_0 = 4e-7 * np.pi
+
+LENGTH_UNITS = {
+    'inches': 0.0254,
+    'millimeters': 1e-3,
+    'centimeters': 1e-2,
+    'mils': 2.54e-5,
+    'meters': 1,
+    'micrometers': 1e-6,
+}
+
+PLOT_TYPES = ('bmag', 'breal', 'bimag', 'hmag', 'hreal', 'himag', 'jmag', 'jreal', 'jimag')
+
+PLOT_UNITS = {'b': 'T', 'h': 'A/m', 'j': 'MA/m^2'}
+
+
+def load_solution(solution):
+    """Accept a ``Solution`` or the path of a ``.ans`` or a saved ``.npz`` solution."""
+
+    if isinstance(solution, Solution):
+        return solution
+    if os.path.splitext(solution)[1] == '.npz':
+        return Solution.load(solution)
+    return read_ans(solution)
+
+
+def _require_block_props(solution):
+    if solution.block_props is None:
+        raise ValueError('The solution was saved without its block properties, read its .ans file instead.')
+
+
+def _plot_label(plot_type):
+    quantity, component = plot_type[0].upper(), plot_type[1:]
+    text = {'mag': f'|{quantity}|', 'real': f'Re({quantity})', 'imag': f'Im({quantity})'}[component]
+    return f'{text} ({PLOT_UNITS[plot_type[0]]})'
+
+
+def flux_density(solution):
+    """Return the x and y components of B in Tesla for each element, complex if the problem is AC.
+    A is linear over each element, so B is the constant curl of A over the element."""
+
+    if solution.header.get('ProblemType') != 'planar':
+        raise NotImplementedError('Only planar problems are supported.')
+
+    scale = LENGTH_UNITS[solution.header.get('LengthUnits', 'millimeters')]
+    x = solution.nodes[solution.elements, 0] * scale
+    y = solution.nodes[solution.elements, 1] * scale
+    a = solution.potential[solution.elements]
+    # Twice the signed area of each element.
+    area = (x[:, 1] - x[:, 0]) * (y[:, 2] - y[:, 0]) - (x[:, 2] - x[:, 0]) * (y[:, 1] - y[:, 0])
+    da_dx = (a[:, 0] * (y[:, 1] - y[:, 2]) + a[:, 1] * (y[:, 2] - y[:, 0]) + a[:, 2] * (y[:, 0] - y[:, 1])) / area
+    da_dy = (a[:, 0] * (x[:, 2] - x[:, 1]) + a[:, 1] * (x[:, 0] - x[:, 2]) + a[:, 2] * (x[:, 1] - x[:, 0])) / area
+    return da_dy, -da_dx
+
+
+def field_intensity(solution, b=None):
+    """Return the x and y components of H in A/m for each element. Nonlinear materials use their
+    B-H curve, linear materials their relative permeability and coercivity."""
+
+    _require_block_props(solution)
+    b_x, b_y = flux_density(solution) if b is None else b
+    b_mag = np.sqrt(np.abs(b_x) ** 2 + np.abs(b_y) ** 2)
+    h_x = np.zeros_like(b_x)
+    h_y = np.zeros_like(b_y)
+    element_blocks = solution.element_blocks
+    mag_directions = np.radians(solution.label_mag_directions[solution.element_labels])
+    for block, props in enumerate(solution.block_props):
+        in_block = element_blocks == block
+        if not in_block.any():
+            continue
+        if props.get('BHPoints'):
+            bh_curve = np.array(props['BHPoints'])
+            h_mag = np.interp(b_mag[in_block], bh_curve[:, 0], bh_curve[:, 1])
+            with np.errstate(divide='ignore', invalid='ignore'):
+                ratio = np.where(b_mag[in_block] > 0, h_mag / b_mag[in_block], 0)
+            h_x[in_block] = b_x[in_block] * ratio
+            h_y[in_block] = b_y[in_block] * ratio
+        else:
+            mu_x = props.get('Mu_x') or 1
+            mu_y = props.get('Mu_y') or mu_x
+            h_c = props.get('H_c') or 0
+            h_x[in_block] = b_x[in_block] / (MU_0 * mu_x) - h_c * np.cos(mag_directions[in_block])
+            h_y[in_block] = b_y[in_block] / (MU_0 * mu_y) - h_c * np.sin(mag_directions[in_block])
+    return h_x, h_y
+
+
+def current_density(solution):
+    """Return the applied current density in MA/m^2 for each element, from both the block
+    properties and any circuit the element's block label is in."""
+
+    _require_block_props(solution)
+    block_densities = np.array([props.get('J_re', 0) + 1j * props.get('J_im', 0) for props in solution.block_props])
+    densities = block_densities[solution.element_blocks] + solution.label_current_densities[solution.element_labels]
+    return densities if solution.frequency != 0 else densities.real
+
+
+def element_field(solution, plot_type='bmag'):
+    """Return one of FEMM's density plot quantities for each element, see ``PLOT_TYPES``."""
+
+    solution = load_solution(solution)
+    quantity, component = plot_type[0], plot_type[1:]
+    if plot_type not in PLOT_TYPES:
+        raise ValueError(f'Unknown plot type {plot_type!r}, must be one of {PLOT_TYPES}.')
+    if quantity == 'j':
+        values = current_density(solution)
+        parts = {'mag': np.abs(values), 'real': np.real(values), 'imag': np.imag(values)}
+        return parts[component]
+    vectors = flux_density(solution) if quantity == 'b' else field_intensity(solution)
+    if component == 'real':
+        vectors = [np.real(vector) for vector in vectors]
+    elif component == 'imag':
+        vectors = [np.imag(vector) for vector in vectors]
+    return np.sqrt(np.abs(vectors[0]) ** 2 + np.abs(vectors[1]) ** 2)
+
+
+def _draw_field_map(ax, solution, values, contours=19, lower_bound=None, upper_bound=None, grey_scale=False):
+    collection = ax.tripcolor(solution.nodes[:, 0], solution.nodes[:, 1], solution.elements, facecolors=values,
+                              vmin=lower_bound, vmax=upper_bound, cmap='gray' if grey_scale else 'jet')
+    if contours:
+        ax.tricontour(solution.nodes[:, 0], solution.nodes[:, 1], solution.elements, np.real(solution.potential),
+                      levels=contours, colors='k', linewidths=0.5)
+    ax.set_aspect('equal')
+    return collection
+
+
+def render_field_map(solution, path=None, plot_type='bmag', contours=19, legend=True, lower_bound=None,
+                     upper_bound=None, grey_scale=False, dpi=150):
+    """Render a density plot of ``plot_type`` with ``contours`` flux lines (set to 0 to hide them).
+    The figure is saved to ``path`` if it is given, otherwise it is returned."""
+
+    solution = load_solution(solution)
+    values = element_field(solution, plot_type)
+    figure = Figure()
+    FigureCanvasAgg(figure)
+    ax = figure.add_subplot(1, 1, 1)
+    collection = _draw_field_map(ax, solution, values, contours, lower_bound, upper_bound, grey_scale)
+    if legend:
+        figure.colorbar(collection, ax=ax, label=_plot_label(plot_type))
+    if path is None:
+        return figure
+    figure.savefig(path, dpi=dpi)
+
+
+def _render_field_map_to_file(args):
+    solution_path, output_path, kwargs = args
+    render_field_map(solution_path, output_path, **kwargs)
+    return output_path
+
+
+def render_field_maps(solution_paths, output_directory, processes=None, **kwargs):
+    """Render a field map of each solution to a ``.png`` of the same name in ``output_directory``
+    using a pool of processes. Takes the same keyword arguments as ``render_field_map``."""
+
+    os.makedirs(output_directory, exist_ok=True)
+    jobs = [
+        (path, os.path.join(output_directory, os.path.splitext(os.path.basename(path))[0] + '.png'), kwargs)
+        for path in solution_paths
+    ]
+    with mp.Pool(processes or mp.cpu_count()) as pool:
+        return pool.map(_render_field_map_to_file, jobs)
+
+
+def _element_field_of_file(args):
+    solution_path, plot_type = args
+    solution = load_solution(solution_path)
+    return solution, element_field(solution, plot_type)
+
+
+def render_sweep_animation(solution_paths, path, plot_type='bmag', contours=19, interval=200, processes=None,
+                           dpi=100):
+    """Animate the field maps of a sweep and save them to ``path``, e.g. ``sweep.gif`` or ``sweep.mp4``.
+    The solutions are read and their fields calculated in parallel, and every frame shares one
+    colour scale so that they can be compared."""
+
+    with mp.Pool(processes or mp.cpu_count()) as pool:
+        frames = pool.map(_element_field_of_file, [(solution_path, plot_type) for solution_path in solution_paths])
+    lower_bound = min(values.min() for _, values in frames)
+    upper_bound = max(values.max() for _, values in frames)
+
+    figure = Figure()
+    FigureCanvasAgg(figure)
+    ax = figure.add_subplot(1, 1, 1)
+    collection = _draw_field_map(ax, *frames[0], contours, lower_bound, upper_bound)
+    figure.colorbar(collection, ax=ax, label=_plot_label(plot_type))
+
+    def draw_frame(frame):
+        ax.clear()
+        _draw_field_map(ax, *frames[frame], contours, lower_bound, upper_bound)
+
+    animation = FuncAnimation(figure, draw_frame, frames=len(frames), interval=interval)
+    animation.save(path, dpi=dpi)
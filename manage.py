@@ -1,28 +1,160 @@
-import sys
+"""Management commands, run with ``python manage.py <command>``, see ``python manage.py --help``.
+
+Each command imports what it needs when it runs, so that starting one, and every scene worker
+process, which imports this module again, does not pay for the imports of the others."""
+
+import argparse
+import importlib
+
+# Modules searched for scenes by name, in order. Others can be added with ``--module``.
+SCENE_MODULES = ['scenes']
+
+
+def find_scene(name, modules=()):
+    """Return the scene class called ``name`` from the first of ``modules`` and then
+    ``SCENE_MODULES`` that defines one."""
+
+    from scenes import BaseScene
+
+    modules = [*modules, *SCENE_MODULES]
+    for module_name in modules:
+        scene_class = getattr(importlib.import_module(module_name), name, None)
+        if isinstance(scene_class, type) and issubclass(scene_class, BaseScene):
+            return scene_class
+    raise ValueError(f'No scene called {name!r} in {", ".join(modules)}.')
+
+
+def list_scenes(modules=()):
+    """Return the names of the scenes with values in ``modules`` and ``SCENE_MODULES``."""
+
+    from scenes import BaseScene
+
+    names = []
+    for module_name in [*modules, *SCENE_MODULES]:
+        module = importlib.import_module(module_name)
+        for name, value in vars(module).items():
+            if isinstance(value, type) and issubclass(value, BaseScene) and len(value.values) and name not in names:
+                names.append(name)
+    return names
+
+
+def _address(address):
+    host, _, port = address.rpartition(':')
+    return host or 'localhost', int(port)
+
+
+def dev(args):
+    from run import hot_reload_pre
+    hot_reload_pre()
+
+
+def pre(args):
+    from run import run_pre
+    run_pre(hold=True)
+
+
+def solve(args):
+    from run import run_pre, run_solve
+    pre_runner, _ = run_pre()
+    run_solve(pre_runner, hold=True)
+
+
+def post(args):
+    from run import run_post, run_pre, run_solve
+    pre_runner, _ = run_pre()
+    pre_runner = run_solve(pre_runner)
+    run_post(pre_runner, hold=True)
+
+
+def scene(args):
+    from scenes import BaseSceneRunner
+    scene_runner = BaseSceneRunner(scene_class=find_scene(args.name, args.module), processes=args.workers,
+                                   timeout=args.timeout or None, max_retries=args.retries)
+    scene_runner.start()
+
+
+def scenes(args):
+    for name in list_scenes(args.module):
+        print(name)
+
+
+def broker(args):
+    from distributed import JobBroker
+    scene_class = find_scene(args.name, args.module)
+    broker = JobBroker(scene_class.values, address=_address(args.address), authkey=args.authkey.encode(),
+                       timeout=args.timeout or None, max_retries=args.retries)
+    print(f'Serving {len(broker.values)} values on {args.address}...')
+    for result in broker.results():
+        print(f'{result.value}: {result.result if result.ok else result.error}')
+    scene_class().display_results(broker.scene_results)
+
+
+def agent(args):
+    from distributed import run_agents
+    run_agents(find_scene(args.name, args.module), address=_address(args.address), authkey=args.authkey.encode(),
+               processes=args.workers, timeout=args.timeout or None)
+
+
+def dataset(args):
+    import glob
+
+    import numpy as np
+
+    from datasets import build_dataset
+    # Expand patterns here, as the Windows shell does not.
+    paths = [path for pattern in args.paths for path in sorted(glob.glob(pattern))]
+    points = np.load(args.points) if args.points is not None else None
+    dataset = build_dataset(paths, args.directory, quantity=args.quantity, points=points, processes=args.workers)
+    print(f'Wrote {dataset.values.shape} {dataset.quantity} values to {args.directory} with '
+          f'{len(dataset.errors)} failures.')
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='manage.py', description='Run a model definition or a scene.')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    commands.add_parser('dev', help='run the pre method with the hot reloader').set_defaults(handler=dev)
+    commands.add_parser('pre', help='run the pre method once').set_defaults(handler=pre)
+    commands.add_parser('solve', help='run the pre and solve methods').set_defaults(handler=solve)
+    commands.add_parser('post', help='run the pre, solve and post methods').set_defaults(handler=post)
+
+    scene_options = argparse.ArgumentParser(add_help=False)
+    scene_options.add_argument('name', help='the name of the scene class, e.g. ForceYScene')
+    scene_options.add_argument('--module', action='append', default=[],
+                               help='a module to search for the scene before scenes.py, can be repeated')
+    scene_options.add_argument('--timeout', type=float, default=600,
+                               help='seconds before a job is given up on, 0 to wait forever (default 600)')
+    scene_options.add_argument('--retries', type=int, default=2, help='times a failed job is retried')
+    network_options = argparse.ArgumentParser(add_help=False)
+    network_options.add_argument('--address', default='localhost:6000', help='host:port of the broker')
+    network_options.add_argument('--authkey', required=True,
+                                 help='shared secret of the broker and agents, anyone with it can run code on them')
+
+    scene_parser = commands.add_parser('scene', parents=[scene_options], help='run a scene on this machine')
+    scene_parser.add_argument('--workers', type=int, help='number of worker processes, one per CPU by default')
+    scene_parser.set_defaults(handler=scene)
+
+    scenes_parser = commands.add_parser('scenes', help='list the scenes that can be run')
+    scenes_parser.add_argument('--module', action='append', default=[], help='another module to search')
+    scenes_parser.set_defaults(handler=scenes)
+
+    commands.add_parser('broker', parents=[scene_options, network_options],
+                        help="hand out a scene's values to agents").set_defaults(handler=broker)
+    agent_parser = commands.add_parser('agent', parents=[scene_options, network_options],
+                                       help='run scene workers for a broker')
+    agent_parser.add_argument('--workers', type=int, help='number of agents, one per CPU by default')
+    agent_parser.set_defaults(handler=agent)
+
+    dataset_parser = commands.add_parser('dataset', help='read many .ans files into one on-disk array')
+    dataset_parser.add_argument('directory', help='directory to write the dataset to')
+    dataset_parser.add_argument('paths', nargs='+', help='.ans files or patterns, e.g. "temp/*.ans"')
+    dataset_parser.add_argument('--quantity', default='potential', help='potential (default), bmag, hmag, jmag...')
+    dataset_parser.add_argument('--points', help='.npy file of an (N, 2) array of probe points')
+    dataset_parser.add_argument('--workers', type=int, help='number of worker processes, one per CPU by default')
+    dataset_parser.set_defaults(handler=dataset)
+    return parser
 
-from run import run_pre, run_solve, hot_reload_pre, run_post
-from scenes import BaseSceneRunner, ForceYScene
 
 if __name__ == '__main__':
-    args = sys.argv
-    if len(args) == 1:
-        raise ValueError('Must provide a command name.')
-    if not len(args) == 2:
-        raise ValueError('Must provide only one argument.')
-    _, command_name = args
-    if command_name == 'dev':
-        hot_reload_pre()
-    elif command_name == 'pre':
-        run_pre(hold=True)
-    elif command_name == 'solve':
-        pre_runner, _ = run_pre()
-        run_solve(pre_runner, hold=True)
-    elif command_name == 'post':
-        pre_runner, _ = run_pre()
-        pre_runner = run_solve(pre_runner)
-        run_post(pre_runner, hold=True)
-    elif command_name == 'scene':
-        scene_runner = BaseSceneRunner(scene_class=ForceYScene)
-        scene_runner.start()
-    else:
-        raise ValueError('No matching command.')
+    args = build_parser().parse_args()
+    args.handler(args)
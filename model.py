@@ -3,7 +3,8 @@ from run import BaseRunner
 
 class Runner(BaseRunner):
 
-    def pre(self, process_id=None, rotor_center=None):
+    def pre(self, process_id=None, rotor_center=None, pole_width=20, coil_gap=0.5, smoothing=1.3, rotor_radius=25,
+            rotor_y=None):
         self.session.new_document(0)
         self.session.set_current_directory('C:/Users/mail/python-femm/temp')
 
@@ -31,18 +32,17 @@ class Runner(BaseRunner):
         center = [60, 60]
         poles = 4
         pole_length = 25
-        pole_width = 20
         stator_radius = 60
         stator_width = 10
-        smoothing = 1.3
         angle = (360 / poles) / smoothing
-        rotor_radius = 25
         rotor_bore = 6
         rotor_center = rotor_center or center
+        if rotor_y is not None:
+            # A single number, so that the rotor's vertical position can be perturbed.
+            rotor_center = [rotor_center[0], rotor_y]
         coil_width = 5
         coil_length = 16
         coil_angle = 45
-        coil_gap = 0.5
 
         # Set the air regions.
         self.session.pre.add_block_label(points=[[60, 130]])
@@ -0,0 +1,148 @@
+"""Parallel optimisation of model parameters, evaluating a whole population of candidates
+at once through a ``BaseSceneRunner`` so that every worker is kept busy."""
+
+import json
+import os
+
+import numpy as np
+
+
+class DifferentialEvolution:
+    """Minimises the objective returned by a scene for parameters within ``bounds``, a dict of
+    ``{name: (low, high)}``, e.g.::
+
+        scene_runner = BaseSceneRunner(scene_class=OptimisationScene)
+        optimiser = DifferentialEvolution(scene_runner, bounds={'pole_width': (15, 25), 'coil_gap': (0.2, 2)},
+                                          history_path='pole_width.jsonl')
+        best_parameters, best_objective = optimiser.run(generations=20)
+
+    Each generation proposes one candidate per member of the population, which defaults to the
+    number of worker processes, and evaluates them all in parallel. Every evaluation is appended
+    to ``history_path`` so an interrupted run is resumed by creating the optimiser again with the
+    same arguments. The history also records the population size, bounds, seed and direction, a
+    resumed run takes its population size from there and refuses to continue with different
+    settings. Candidates whose scene fails are given an objective of infinity. Set ``maximise`` to
+    maximise the objective instead."""
+
+    def __init__(self, scene_runner, bounds, population_size=None, mutation=0.8, crossover=0.9, history_path=None,
+                 maximise=False, seed=0):
+        self.scene_runner = scene_runner
+        self.names = list(bounds)
+        self.low = np.array([bounds[name][0] for name in self.names], dtype='float64')
+        self.high = np.array([bounds[name][1] for name in self.names], dtype='float64')
+        self.population_size = None if population_size is None else max(population_size, 4)
+        self.mutation = mutation
+        self.crossover = crossover
+        self.history_path = history_path
+        self.sign = -1 if maximise else 1
+        self.seed = seed
+        self.generation = 0
+        self.population = None
+        self.objectives = None
+        self._resume()
+
+    def _random(self):
+        # Seeding by generation means a resumed run proposes the same candidates it would have done.
+        return np.random.RandomState([self.seed, self.generation])
+
+    def _parameters(self, candidate):
+        return {name: float(value) for name, value in zip(self.names, candidate)}
+
+    def _settings(self):
+        return {
+            'population_size': self.population_size,
+            'bounds': {name: [float(low), float(high)] for name, low, high in zip(self.names, self.low, self.high)},
+            'seed': self.seed,
+            'maximise': self.sign == -1,
+        }
+
+    def _resume(self):
+        history = []
+        if self.history_path is not None and os.path.exists(self.history_path):
+            with open(self.history_path) as f:
+                history = [json.loads(line) for line in f if line.strip()]
+        settings = next((entry['settings'] for entry in history if 'settings' in entry), None)
+        # Keep the last evaluation of each candidate, in case a generation was written twice.
+        evaluations = {(entry['generation'], entry['index']): entry for entry in history if 'settings' not in entry}
+
+        if settings is not None:
+            if self.population_size is None:
+                self.population_size = settings['population_size']
+            if self._settings() != settings:
+                raise ValueError(f'The settings {self._settings()} differ from those of the run in '
+                                 f'{self.history_path}, {settings}.')
+        else:
+            if self.population_size is None and evaluations:
+                # Histories written before the settings were recorded.
+                self.population_size = max(index for _, index in evaluations) + 1
+            self.population_size = max(self.population_size or self.scene_runner.processes, 4)
+            if self.history_path is not None:
+                with open(self.history_path, 'a') as f:
+                    f.write(json.dumps({'settings': self._settings()}) + '\n')
+
+        for generation in sorted({generation for generation, _ in evaluations}):
+            entries = [evaluations.get((generation, index)) for index in range(self.population_size)]
+            if None in entries:
+                # The generation was interrupted part way through, it is re-run.
+                break
+            candidates = np.array([[entry['parameters'][name] for name in self.names] for entry in entries])
+            objectives = np.array([np.inf if entry['objective'] is None else self.sign * entry['objective']
+                                   for entry in entries])
+            self._select(candidates, objectives)
+            self.generation = generation + 1
+
+    def _propose(self):
+        random = self._random()
+        if self.population is None:
+            return self.low + random.rand(self.population_size, len(self.names)) * (self.high - self.low)
+        candidates = np.empty_like(self.population)
+        for i in range(self.population_size):
+            a, b, c = random.choice([j for j in range(self.population_size) if j != i], 3, replace=False)
+            mutant = self.population[a] + self.mutation * (self.population[b] - self.population[c])
+            crossed = random.rand(len(self.names)) < self.crossover
+            crossed[random.randint(len(self.names))] = True
+            candidates[i] = np.clip(np.where(crossed, mutant, self.population[i]), self.low, self.high)
+        return candidates
+
+    def _select(self, candidates, objectives):
+        if self.population is None:
+            self.population, self.objectives = candidates, objectives
+            return
+        improved = objectives <= self.objectives
+        self.population[improved] = candidates[improved]
+        self.objectives[improved] = objectives[improved]
+
+    def _evaluate(self, candidates):
+        results = self.scene_runner.run_jobs([self._parameters(candidate) for candidate in candidates])
+        objectives = np.array([self.sign * result.result if result.ok else np.inf for result in results],
+                              dtype='float64')
+        if self.history_path is not None:
+            with open(self.history_path, 'a') as f:
+                for index, (candidate, result) in enumerate(zip(candidates, results)):
+                    f.write(json.dumps({
+                        'generation': self.generation,
+                        'index': index,
+                        'parameters': self._parameters(candidate),
+                        'objective': result.result if result.ok else None,
+                        'error': result.error,
+                        'duration': result.duration,
+                    }) + '\n')
+        return objectives
+
+    @property
+    def best(self):
+        """The best parameters found so far and their objective."""
+
+        best_index = int(np.argmin(self.objectives))
+        return self._parameters(self.population[best_index]), self.sign * float(self.objectives[best_index])
+
+    def run(self, generations):
+        """Run until ``generations`` generations have been evaluated, including any resumed ones."""
+
+        while self.generation < generations:
+            candidates = self._propose()
+            self._select(candidates, self._evaluate(candidates))
+            best_parameters, best_objective = self.best
+            print(f'Generation {self.generation}: best objective {best_objective} with {best_parameters}')
+            self.generation += 1
+        return self.best
@@ -1,18 +1,19 @@
 import os
 import time
 import importlib
-import pywintypes
 
 from wrapper import FEMMSession
 
 
 class BaseRunner:
 
-    def __init__(self, session=None):
+    def __init__(self, session=None, profile='interactive', transport=None):
         self.session = session
+        self.profile = profile
+        self.transport = transport
 
     def start(self):
-        self.session = FEMMSession()
+        self.session = FEMMSession(profile=self.profile, transport=self.transport)
 
     def pre(self):
         raise NotImplementedError('You need to implement this method.')
@@ -50,6 +51,8 @@ def run_pre(hold=False):
 
 
 def hot_reload_pre():
+    import pywintypes
+
     path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'model.py')
     most_recent_change = os.path.getmtime(path)
     most_recent_runner, model = run_pre()
@@ -1,46 +1,577 @@
 import multiprocessing as mp
-import _winapi
+import os
+import random
+import subprocess
+import sys
 import time
+from multiprocessing import shared_memory
+from multiprocessing.connection import wait
 
-import matplotlib.pyplot as plt
 import numpy as np
 
 from model import Runner
 
 
+def _femm_process_ids():
+    """Return the process ids of every running ``femm.exe``."""
+
+    output = subprocess.run(
+        ['tasklist', '/FI', 'IMAGENAME eq femm.exe', '/FO', 'CSV', '/NH'],
+        stdout=subprocess.PIPE,
+        universal_newlines=True,
+    ).stdout
+    process_ids = set()
+    for line in output.splitlines():
+        columns = line.strip().strip('"').split('","')
+        if len(columns) > 1 and columns[1].isdigit():
+            process_ids.add(int(columns[1]))
+    return process_ids
+
+
+def _kill_femm(process_ids):
+    """Force kill the given FEMM processes along with any ``fkern`` they started."""
+
+    for process_id in process_ids:
+        subprocess.run(['taskkill', '/F', '/T', '/PID', str(process_id)],
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+class ResultBuffers:
+    """Shared memory arrays that scene workers write their bulk results into, so that the arrays
+    never have to be pickled back to the parent. ``schema`` maps each result name to its
+    ``(shape, dtype)`` for a single value, every array gets one row per value, e.g.
+    ``ResultBuffers({'b_mag': ((100,), 'float64')}, length=1000)``.
+
+    Pickling only sends the names of the shared memory blocks, so the buffers can be passed to
+    worker processes which then attach to the same memory."""
+
+    def __init__(self, schema, length, block_names=None):
+        self.schema = schema
+        self.length = length
+        self.blocks = {}
+        self.arrays = {}
+        for name, (shape, dtype) in schema.items():
+            shape = (length, *shape)
+            if block_names is None:
+                size = max(int(np.prod(shape)) * np.dtype(dtype).itemsize, 1)
+                block = shared_memory.SharedMemory(create=True, size=size)
+            else:
+                block = shared_memory.SharedMemory(name=block_names[name])
+            self.blocks[name] = block
+            self.arrays[name] = np.ndarray(shape, dtype=dtype, buffer=block.buf)
+        self.owner = block_names is None
+
+    def __getstate__(self):
+        return self.schema, self.length, {name: block.name for name, block in self.blocks.items()}
+
+    def __setstate__(self, state):
+        self.__init__(*state)
+
+    def __getitem__(self, name):
+        return self.arrays[name]
+
+    @property
+    def nbytes(self):
+        return sum(array.nbytes for array in self.arrays.values())
+
+    def row(self, index):
+        """Return views of every array for the value at ``index``."""
+
+        return {name: array[index] for name, array in self.arrays.items()}
+
+    def close(self):
+        """Release the shared memory, it is freed once the creating process has also closed it.
+        Any views of the arrays must be deleted before calling this."""
+
+        self.arrays = {}
+        for block in self.blocks.values():
+            block.close()
+            if self.owner:
+                block.unlink()
+        self.blocks = {}
+
+
+class SceneResult:
+    """The outcome of running a scene for a single value. ``error`` is ``None`` if the
+    run succeeded, otherwise it describes the last failure, e.g. ``'timeout'``. If the scene
+    declares a ``result_schema``, ``fields`` holds views of this value's rows in the shared
+    result buffers."""
+
+    __slots__ = ('value', 'result', 'error', 'attempts', 'duration', 'fields')
+
+    def __init__(self, value, result=None, error=None, attempts=0, duration=None, fields=None):
+        self.value = value
+        self.result = result
+        self.error = error
+        self.attempts = attempts
+        self.duration = duration
+        self.fields = fields
+
+    @property
+    def ok(self):
+        return self.error is None
+
+    def __repr__(self):
+        if self.ok:
+            return f'SceneResult(value={self.value!r}, result={self.result!r})'
+        return f'SceneResult(value={self.value!r}, error={self.error!r}, attempts={self.attempts})'
+
+
+def _scene_worker(scene, job_queue, connection, buffers=None):
+    """Worker process loop. Starts the scene's FEMM instance once the parent sends ``'start'``,
+    then runs each job sent to ``job_queue`` until ``None`` is received, sending the outcome of each
+    back through ``connection``. Exits after the first failed job so that the parent can replace it
+    with a fresh worker and FEMM instance.
+
+    With ``buffers``, the scene can write its arrays in place through ``scene.output`` or
+    return them in a dict, either way only the remaining values are sent back to the parent."""
+
+    if job_queue.get() is None:
+        return
+    scene.start_worker()
+    connection.send(('ready',))
+    try:
+        while True:
+            job = job_queue.get()
+            if job is None:
+                break
+            index, value = job
+            start_time = time.perf_counter()
+            try:
+                if buffers is not None:
+                    scene.output = buffers.row(index)
+                result = scene.run_scene(value)
+                if buffers is not None and isinstance(result, dict):
+                    for name in buffers.schema:
+                        if name in result:
+                            scene.output[name][...] = result.pop(name)
+            except Exception as e:
+                connection.send(('error', index, repr(e), time.perf_counter() - start_time))
+                break
+            connection.send(('done', index, result, time.perf_counter() - start_time))
+    finally:
+        scene.stop_worker()
+        if buffers is not None:
+            scene.output = None
+            buffers.close()
+
+
+class _WorkerHandle:
+    """Parent side bookkeeping for a single worker process."""
+
+    def __init__(self, process, job_queue, connection):
+        self.process = process
+        self.job_queue = job_queue
+        self.connection = connection
+        self.femm_process_ids = set()
+        self.existing_femm_process_ids = None
+        self.ready = False
+        self.spawned_at = time.perf_counter()
+        self.started_at = None
+        self.job = None
+        self.job_started_at = None
+        self.stopping = False
+
+
 class BaseSceneRunner:
+    """Runs a scene's values across a pool of worker processes, each with its own FEMM instance.
 
-    def __init__(self, scene_class=None):
+    Each job is given ``timeout`` seconds to complete, ten minutes by default, after which the
+    worker and its FEMM instance are killed and replaced. Set it to ``None`` to wait forever. Jobs that time out, crash their worker or raise are
+    retried up to ``max_retries`` times, then recorded as a failed ``SceneResult``. Workers whose
+    FEMM instance does not start within ``start_timeout`` seconds are also replaced.
+
+    Workers start FEMM one at a time, when the parent hands them the start token. Any ``femm.exe``
+    that appears meanwhile then belongs to that worker, so it can be killed with the worker even if
+    FEMM hangs while starting. Each worker also sends its results through its own pipe, so that no
+    lock is shared between workers that a killed one could leave held.
+
+    Workers are always spawned, as they must be on Windows, rather than forked from a parent that
+    has queue threads running. ``worker_start_times`` holds the seconds each worker of the last run took from being spawned
+    to being ready for its first job, including starting FEMM. Once the jobs are done, workers are
+    given ``stop_timeout`` seconds to close FEMM before they are killed."""
+
+    poll_interval = 0.1
+    stop_timeout = 10
+
+    def __init__(self, scene_class=None, processes=None, timeout=600, max_retries=2, start_timeout=60):
         self.scene_class = scene_class()
+        self.processes = processes or mp.cpu_count()
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.start_timeout = start_timeout
+        self.results = []
+        self.buffers = None
+        self.worker_start_times = []
 
     def start(self):
-        print(f'Running scene with {len(self.scene_class.values)} instances, on {mp.cpu_count()} processes...')
-        mp.set_executable(_winapi.GetModuleFileName(0))
+        print(f'Running scene with {len(self.scene_class.values)} instances, on {self.processes} processes...')
+        if sys.platform == 'win32':
+            import _winapi
+            mp.set_executable(_winapi.GetModuleFileName(0))
         start_time = time.perf_counter()
-        with mp.Pool(mp.cpu_count()) as pool:
-            self.results = pool.map(self.scene_class.run_scene, self.scene_class.values)
+        self.results = self.run_jobs(self.scene_class.values)
         end_time = time.perf_counter()
-        print(f'Finished in {np.round(end_time - start_time)} seconds.')
+        failures = len([result for result in self.results if not result.ok])
+        print(f'Finished in {np.round(end_time - start_time)} seconds with {failures} failures.')
         self.end()
 
+    def run_jobs(self, values):
+        """Run the scene for every value and return a ``SceneResult`` for each, in order."""
+
+        values = list(values)
+        if self.scene_class.result_schema is not None:
+            self.close()
+            self.buffers = ResultBuffers(self.scene_class.result_schema, len(values))
+        results = [SceneResult(value) for value in values]
+        pending = list(range(len(values)))
+        context = mp.get_context('spawn')
+        workers = {}
+        self.worker_start_times = []
+        failed_starts = 0
+
+        def spawn():
+            job_queue = context.Queue()
+            receiver, sender = context.Pipe(duplex=False)
+            process = context.Process(target=_scene_worker, args=(self.scene_class, job_queue, sender,
+                                                                  self.buffers))
+            process.daemon = True
+            process.start()
+            sender.close()
+            workers[process.pid] = _WorkerHandle(process, job_queue, receiver)
+
+        def starting():
+            return any(not worker.ready and worker.started_at is not None for worker in workers.values())
+
+        def start_next():
+            for worker in workers.values():
+                if worker.started_at is None:
+                    worker.existing_femm_process_ids = self.scene_class.femm_process_ids()
+                    worker.started_at = time.perf_counter()
+                    worker.job_queue.put('start')
+                    return
+
+        def new_femm_process_ids(worker):
+            return self.scene_class.femm_process_ids() - worker.existing_femm_process_ids
+
+        def kill(worker):
+            worker.process.kill()
+            worker.process.join()
+            worker.connection.close()
+            if not worker.ready and worker.started_at is not None:
+                # Killed while starting, so any new FEMM instance is this worker's.
+                worker.femm_process_ids = new_femm_process_ids(worker)
+            self.scene_class.kill_femm(worker.femm_process_ids)
+
+        def recycle(worker):
+            kill(worker)
+            del workers[worker.process.pid]
+            if pending or any(other.job is not None for other in workers.values()):
+                spawn()
+
+        def fail(worker, error, duration=None):
+            index = worker.job
+            worker.job = None
+            results[index].error = error
+            results[index].duration = duration
+            if results[index].attempts <= self.max_retries:
+                # Put retries at the front so that they are not starved by the remaining values.
+                pending.insert(0, index)
+            recycle(worker)
+
+        for _ in range(min(self.processes, len(values))):
+            spawn()
+        try:
+            while pending or any(worker.job is not None for worker in workers.values()):
+                if not starting():
+                    start_next()
+                for worker in workers.values():
+                    if worker.ready and worker.job is None and pending:
+                        worker.job = pending.pop(0)
+                        worker.job_started_at = time.perf_counter()
+                        results[worker.job].attempts += 1
+                        worker.job_queue.put((worker.job, values[worker.job]))
+
+                connections = {worker.connection: worker for worker in workers.values()}
+                for connection in wait(list(connections), timeout=self.poll_interval):
+                    worker = connections[connection]
+                    if worker.process.pid not in workers:
+                        continue
+                    try:
+                        kind, *payload = connection.recv()
+                    except (EOFError, OSError):
+                        # The worker has exited, which is handled below.
+                        continue
+                    if kind == 'ready':
+                        worker.ready = True
+                        worker.femm_process_ids = new_femm_process_ids(worker)
+                        self.worker_start_times.append(time.perf_counter() - worker.spawned_at)
+                    elif kind == 'done':
+                        index, result, duration = payload
+                        worker.job = None
+                        results[index].result = result
+                        results[index].error = None
+                        results[index].duration = duration
+                        if self.buffers is not None:
+                            results[index].fields = self.buffers.row(index)
+                    elif kind == 'error':
+                        _, error, duration = payload
+                        fail(worker, error, duration)
+
+                now = time.perf_counter()
+                for worker in list(workers.values()):
+                    if worker.job is not None:
+                        if self.timeout is not None and now - worker.job_started_at > self.timeout:
+                            fail(worker, 'timeout', now - worker.job_started_at)
+                        elif not worker.process.is_alive():
+                            fail(worker, f'worker exited with code {worker.process.exitcode}',
+                                 now - worker.job_started_at)
+                    elif not worker.ready and (not worker.process.is_alive() or (
+                            worker.started_at is not None and now - worker.started_at > self.start_timeout)):
+                        # FEMM failed to start. No job is charged but give up if it keeps happening.
+                        failed_starts += 1
+                        if failed_starts > self.processes * (self.max_retries + 1):
+                            raise RuntimeError('Scene workers repeatedly failed to start.')
+                        recycle(worker)
+        finally:
+            for worker in workers.values():
+                if worker.ready and worker.job is None and worker.process.is_alive():
+                    worker.job_queue.put(None)
+                    worker.stopping = True
+            for worker in workers.values():
+                if worker.stopping:
+                    worker.process.join(timeout=self.stop_timeout)
+                if worker.process.is_alive():
+                    kill(worker)
+        return results
+
     def end(self):
         print(f'Displaying results...')
         self.scene_class.display_results(self.results)
 
+    def close(self):
+        """Free the shared result buffers of the last run, this invalidates every ``SceneResult.fields``."""
+
+        if self.buffers is not None:
+            for result in self.results:
+                result.fields = None
+            self.buffers.close()
+            self.buffers = None
+
 
-class ForceYScene:
+class BaseScene:
+    """A scene runs the same model for each of ``values``. A worker process calls ``start_worker``
+    once, then ``run_scene`` for each value it is given and finally ``stop_worker``.
+
+    Scenes that produce arrays, e.g. field profiles, should declare them in ``result_schema``
+    as ``{name: (shape, dtype)}``. ``run_scene`` can then either write into the views in
+    ``self.output`` or return a dict containing them."""
+
+    values = []
+    result_schema = None
+    output = None
+
+    def start_worker(self):
+        pass
+
+    def run_scene(self, value):
+        raise NotImplementedError('You need to implement this method.')
+
+    def stop_worker(self):
+        pass
+
+    def femm_process_ids(self):
+        """Return the ids of the FEMM processes that are running, used to find the FEMM
+        instance started by ``start_worker``."""
+
+        return set()
+
+    def kill_femm(self, process_ids):
+        pass
+
+    def display_results(self, results):
+        raise NotImplementedError('You need to implement this method.')
+
+
+class RunnerScene(BaseScene):
+    """A scene where each worker drives its own FEMM instance through a ``runner_class``.
+
+    The sessions use the ``'batch'`` execution profile unless ``profile`` says otherwise, and talk
+    to FEMM over COM unless ``transport`` is set to a callable that returns a transport, e.g.
+    ``functools.partial(ReplayTransport, 'trace.jsonl')``. If ``store_directory`` is set, ``store_solution`` moves each solution into a ``ResultStore``
+    there instead of leaving the ``.ans`` and ``.fem`` files behind."""
+
+    runner_class = Runner
+    profile = 'batch'
+    transport = None
+    store_directory = None
+
+    def start_worker(self):
+        transport = self.transport() if self.transport is not None else None
+        self.runner = self.runner_class(profile=self.profile, transport=transport)
+        self.runner.start()
+        self.store = None
+        if self.store_directory is not None:
+            from store import ResultStore, model_hash
+            self.store = ResultStore(self.store_directory)
+            self.model_hash = model_hash()
+
+    def stop_worker(self):
+        self.runner.session.quit()
+        if self.store is not None:
+            self.store.close()
+
+    def store_solution(self, parameters=None, scalars=None, timings=None):
+        """Add the last solution to the result store, if there is one. The FEMM documents
+        must have been closed first."""
+
+        if self.store is not None:
+            self.store.add(self.runner.session.pre.solution_path, parameters=parameters, scalars=scalars,
+                           timings=timings, model_hash=self.model_hash)
+
+    def femm_process_ids(self):
+        # FEMM only runs on Windows, anywhere else the transport cannot be starting it.
+        return _femm_process_ids() if sys.platform == 'win32' else set()
+
+    def kill_femm(self, process_ids):
+        _kill_femm(process_ids)
+
+
+class ForceYScene(RunnerScene):
 
     values = np.linspace(60, 61, 10)
 
-    @staticmethod
-    def run_scene(value):
-        runner = Runner()
-        runner.start()
-        runner.pre(process_id=mp.current_process(), rotor_center=[60, value])
-        runner.solve()
-        force_y = runner.post()
+    def run_scene(self, value):
+        start_time = time.perf_counter()
+        self.runner.pre(process_id=mp.current_process(), rotor_center=[60, value])
+        pre_time = time.perf_counter()
+        self.runner.solve()
+        solve_time = time.perf_counter()
+        force_y = self.runner.post()
+        post_time = time.perf_counter()
+        self.runner.session.post.close()
+        self.runner.close()
+        self.store_solution(
+            parameters={'rotor_y': value},
+            scalars={'force_y': force_y},
+            timings={'pre': pre_time - start_time, 'solve': solve_time - pre_time, 'post': post_time - solve_time},
+        )
         return force_y
 
     def display_results(self, results):
-        plt.plot(self.values, results)
+        import matplotlib.pyplot as plt
+
+        succeeded = [result for result in results if result.ok]
+        plt.plot([result.value for result in succeeded], [result.result for result in succeeded])
         plt.show()
+
+
+class OptimisationScene(RunnerScene):
+    """Runs the model for each candidate set of parameters proposed by an optimiser, each value is a
+    dict of keyword arguments for ``Runner.pre`` and the objective is whatever ``Runner.post`` returns."""
+
+    def run_scene(self, parameters):
+        self.runner.pre(process_id=mp.current_process(), **parameters)
+        self.runner.solve()
+        objective = self.runner.post()
+        self.runner.session.post.close()
+        self.runner.close()
+        return objective
+
+    def display_results(self, results):
+        for result in results:
+            print(result)
+
+
+class SensitivityScene(OptimisationScene):
+    """Like ``OptimisationScene``, but values may also include the current of any circuit named in
+    ``circuit_names``. Those are set on the already drawn model rather than being passed to
+    ``Runner.pre``, so when only currents differ from the last value this worker ran the geometry is
+    not redrawn.
+
+    A value can also be a list of parameter dicts that only differ in their currents. The worker
+    then draws the geometry once, solves for each set of currents in turn and returns a list of the
+    objectives, which is how ``sensitivity.jacobian`` makes sure the drawing is reused."""
+
+    circuit_names = ('winding_1', 'winding_2', 'winding_3', 'winding_4')
+
+    def start_worker(self):
+        super().start_worker()
+        self.drawn_parameters = None
+        self.drawn_circuits = set()
+
+    def run_scene(self, parameters):
+        if isinstance(parameters, list):
+            return [self._solve(value) for value in parameters]
+        return self._solve(parameters)
+
+    def _solve(self, parameters):
+        geometry = {name: value for name, value in parameters.items() if name not in self.circuit_names}
+        currents = {name: value for name, value in parameters.items() if name in self.circuit_names}
+        # Currents set by an earlier value can only be kept if this value sets them again.
+        if geometry != self.drawn_parameters or not self.drawn_circuits <= set(currents):
+            if self.drawn_parameters is not None:
+                self.runner.close()
+            self.runner.pre(process_id=mp.current_process(), **geometry)
+            self.drawn_parameters = geometry
+        for circuit_name, current in currents.items():
+            self.runner.session.pre.modify_circuit_prop(circuit_name=circuit_name, prop_number=1, value=current)
+        if currents:
+            # Save the new currents so that the solver sees them.
+            self.runner.session.pre.save_as(os.path.basename(self.runner.session.document_path))
+        self.drawn_circuits = set(currents)
+        self.runner.solve()
+        objective = self.runner.post()
+        self.runner.session.post.close()
+        return objective
+
+
+class BProfileScene(ForceYScene):
+    """Same as ``ForceYScene`` but also samples |B| at ``profile_points`` points along the
+    horizontal line through the rotor center. The profiles are returned through shared memory."""
+
+    values = np.linspace(60, 61, 10)
+    profile_points = 200
+    result_schema = {'b_mag': ((profile_points,), 'float64')}
+
+    def run_scene(self, value):
+        self.runner.pre(process_id=mp.current_process(), rotor_center=[60, value])
+        self.runner.solve()
+        force_y = self.runner.post()
+        for i, x in enumerate(np.linspace(0, 120, self.profile_points)):
+            point_values = self.runner.session.post.get_point_values(x, value)
+            self.output['b_mag'][i] = np.hypot(point_values[1], point_values[2])
+        self.runner.session.post.close()
+        self.runner.close()
+        return force_y
+
+
+class FaultyScene(BaseScene):
+    """A scene that does not use FEMM, instead it sleeps for ``duration`` seconds per value and
+    hangs, crashes its worker or raises at random with the given rates. Used to exercise the fault
+    handling of ``BaseSceneRunner``, e.g. ``BaseSceneRunner(FaultyScene, timeout=1).start()``."""
+
+    values = np.linspace(0, 1, 100)
+    duration = 0.05
+    hang_rate = 0.02
+    crash_rate = 0.02
+    error_rate = 0.02
+
+    def run_scene(self, value):
+        roll = random.random()
+        if roll < self.hang_rate:
+            while True:
+                time.sleep(1)
+        roll -= self.hang_rate
+        if roll < self.crash_rate:
+            os._exit(1)
+        roll -= self.crash_rate
+        if roll < self.error_rate:
+            raise RuntimeError(f'Simulated FEMM error for {value}.')
+        time.sleep(self.duration)
+        return value
+
+    def display_results(self, results):
+        for result in results:
+            if not result.ok:
+                print(result)
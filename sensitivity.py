@@ -0,0 +1,123 @@
+"""Finite difference sensitivities of a scene's outputs to its parameters, with every perturbed
+solve run at the same time through a ``BaseSceneRunner``.
+
+FEMM's solvers are real valued and have no way of being given an initial solution, so complex step
+derivatives and warm starts are not possible. Instead, when there are more solves than workers, the
+base solve and every perturbation of a circuit current are sent to one worker as a single job, so
+that the geometry is drawn once for all of them."""
+
+import numbers
+
+import numpy as np
+
+from scenes import SceneResult
+
+METHODS = ('forward', 'central')
+
+
+class Sensitivity:
+    """The result of ``jacobian``:
+
+        – ``jacobian``: ``(outputs, parameters)`` array of derivatives;
+        – ``base_output``: the outputs at the base parameters;
+        – ``diagnostics``: a dict for each parameter with its ``step``, the ``forward`` (and for
+          central differences ``backward``) derivatives, ``truncation_error``, an estimate from the
+          difference between the forward and backward derivatives, and ``relative_change``, the size
+          of the change in output relative to the output. A ``relative_change`` close to the solver's
+          precision means the step is too small and the derivative is mostly noise."""
+
+    def __init__(self, parameter_names, jacobian, base_output, diagnostics):
+        self.parameter_names = parameter_names
+        self.jacobian = jacobian
+        self.base_output = base_output
+        self.diagnostics = diagnostics
+
+    def __getitem__(self, parameter_name):
+        """The derivatives of every output with respect to ``parameter_name``."""
+
+        return self.jacobian[:, self.parameter_names.index(parameter_name)]
+
+
+def _is_number(value):
+    return isinstance(value, numbers.Real) and not isinstance(value, bool)
+
+
+def _step(value, relative_step, minimum_step):
+    return max(abs(value) * relative_step, minimum_step)
+
+
+def _run(scene_runner, values, group):
+    """Run every value, those at the indices in ``group`` as a single job, and return the results in
+    the same order as ``values``."""
+
+    if len(group) < 2:
+        return scene_runner.run_jobs(values)
+    others = [i for i in range(len(values)) if i not in group]
+    results = scene_runner.run_jobs([[values[i] for i in group], *(values[i] for i in others)])
+    grouped, *other_results = results
+    ordered = [None] * len(values)
+    for position, i in enumerate(group):
+        ordered[i] = SceneResult(values[i], grouped.result[position] if grouped.ok else None, grouped.error,
+                                 grouped.attempts, grouped.duration)
+    for i, result in zip(others, other_results):
+        ordered[i] = result
+    return ordered
+
+
+def jacobian(scene_runner, base_parameters, parameter_names=None, method='central', relative_step=1e-3,
+             minimum_step=1e-3):
+    """Calculate the derivatives of the scene's outputs (a number or a sequence of numbers) with
+    respect to each of ``parameter_names``, by default every number in ``base_parameters``. Only
+    numbers can be perturbed, so e.g. use ``rotor_y`` rather than ``rotor_center`` for the rotor's
+    position. The step for each parameter is ``relative_step`` times its value, but no less than
+    ``minimum_step``.
+
+    The base solve and every perturbed solve are run in a single call to ``scene_runner.run_jobs``,
+    so with enough workers the whole Jacobian takes as long as one solve. With fewer workers than
+    solves, and a scene with ``circuit_names`` such as ``SensitivityScene``, the base solve and the
+    perturbations of those circuits' currents are run as one job on a single drawing of the geometry."""
+
+    if method not in METHODS:
+        raise ValueError(f'Unknown method {method!r}, must be one of {METHODS}.')
+    if parameter_names is None:
+        parameter_names = [name for name, value in base_parameters.items() if _is_number(value)]
+    parameter_names = list(parameter_names)
+    for name in parameter_names:
+        if not _is_number(base_parameters[name]):
+            raise ValueError(f'Parameter {name!r} is {base_parameters[name]!r}, only numbers can be perturbed.')
+    steps = [_step(base_parameters[name], relative_step, minimum_step) for name in parameter_names]
+    signs = (1, -1) if method == 'central' else (1,)
+
+    values = [dict(base_parameters)]
+    for name, step in zip(parameter_names, steps):
+        for sign in signs:
+            values.append({**base_parameters, name: base_parameters[name] + sign * step})
+    circuit_names = getattr(scene_runner.scene_class, 'circuit_names', ())
+    group = []
+    if len(values) > scene_runner.processes:
+        group = [0] + [1 + i * len(signs) + j for i, name in enumerate(parameter_names) if name in circuit_names
+                       for j in range(len(signs))]
+    results = _run(scene_runner, values, group)
+    failed = [result for result in results if not result.ok]
+    if failed:
+        raise RuntimeError(f'{len(failed)} of the solves failed, the first with {failed[0].error}.')
+    outputs = [np.atleast_1d(np.asarray(result.result, dtype='float64')) for result in results]
+
+    base_output = outputs[0]
+    columns = []
+    diagnostics = {}
+    for i, (name, step) in enumerate(zip(parameter_names, steps)):
+        forward_output = outputs[1 + i * len(signs)]
+        forward = (forward_output - base_output) / step
+        with np.errstate(divide='ignore', invalid='ignore'):
+            relative_change = np.abs(forward_output - base_output) / np.abs(base_output)
+        diagnostic = {'step': step, 'forward': forward, 'relative_change': relative_change}
+        if method == 'central':
+            backward = (base_output - outputs[2 + i * len(signs)]) / step
+            diagnostic['backward'] = backward
+            diagnostic['truncation_error'] = np.abs(forward - backward) / 2
+            columns.append((forward + backward) / 2)
+        else:
+            columns.append(forward)
+        diagnostics[name] = diagnostic
+    return Sensitivity(parameter_names, np.stack(columns, axis=1), base_output, diagnostics)
@@ -0,0 +1,146 @@
+import hashlib
+import numbers
+import os
+import sqlite3
+import time
+import uuid
+
+from ans import Solution, read_ans
+
+
+def model_hash(path=None):
+    """Return a hash of the model definition, by default the ``model.py`` next to this file."""
+
+    path = path or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'model.py')
+    with open(path, 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+def _value_rows(kind, values):
+    """Return a ``(kind, name, value)`` row for each number in ``values``. Complex numbers, such as AC
+    block integrals, are split into ``name.real`` and ``name.imag`` rows, which ``query`` joins again."""
+
+    rows = []
+    for name, value in (values or {}).items():
+        if isinstance(value, numbers.Real):
+            rows.append((kind, name, float(value)))
+        elif isinstance(value, numbers.Complex):
+            rows.extend([(kind, f'{name}.real', float(value.real)), (kind, f'{name}.imag', float(value.imag))])
+        else:
+            raise TypeError(f'The {kind} {name!r} is {value!r}, only numbers can be stored.')
+    return rows
+
+
+def _join_complex(values):
+    for name in [name[:-len('.real')] for name in values if name.endswith('.real')]:
+        if f'{name}.imag' in values:
+            values[name] = complex(values.pop(f'{name}.real'), values.pop(f'{name}.imag'))
+
+
+class ResultStore:
+    """Stores finished solutions as compressed arrays in ``directory``, alongside a SQLite index of
+    each run's parameters, scalar outputs and timings so that runs can be found without reading
+    any solutions, e.g. ``store.query(rotor_y=(60.2, 60.5))``.
+
+    Several processes can add runs to the same store at once."""
+
+    index_name = 'index.sqlite'
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.connection = sqlite3.connect(os.path.join(directory, self.index_name), timeout=60)
+        with self.connection:
+            self.connection.executescript('''
+                CREATE TABLE IF NOT EXISTS runs (
+                    id INTEGER PRIMARY KEY,
+                    model_hash TEXT,
+                    created REAL,
+                    solution TEXT
+                );
+                CREATE TABLE IF NOT EXISTS run_values (
+                    run_id INTEGER REFERENCES runs(id),
+                    kind TEXT,
+                    name TEXT,
+                    value REAL
+                );
+                CREATE INDEX IF NOT EXISTS run_values_lookup ON run_values (kind, name, value);
+                CREATE INDEX IF NOT EXISTS run_values_run ON run_values (run_id);
+            ''')
+
+    def add(self, ans_path, parameters=None, scalars=None, timings=None, model_hash=None, delete=True):
+        """Convert the solution in ``ans_path`` to compressed arrays and index it. With ``delete``
+        the ``.ans`` file and its ``.fem`` file are removed afterwards. Returns the run id.
+
+        Every parameter, scalar and timing must be a number, otherwise ``TypeError`` is raised
+        before anything is written."""
+
+        rows = (_value_rows('parameter', parameters) + _value_rows('scalar', scalars)
+                + _value_rows('timing', timings))
+        # Convert the solution before writing to the index so that other processes are not
+        # locked out of the index while it is compressed.
+        solution_name = f'{uuid.uuid4().hex}.npz'
+        solution_path = os.path.join(self.directory, solution_name)
+        read_ans(ans_path).save(solution_path)
+        try:
+            with self.connection:
+                cursor = self.connection.execute(
+                    'INSERT INTO runs (model_hash, created, solution) VALUES (?, ?, ?)',
+                    (model_hash, time.time(), solution_name))
+                run_id = cursor.lastrowid
+                self.connection.executemany('INSERT INTO run_values (run_id, kind, name, value) VALUES (?, ?, ?, ?)',
+                                            [(run_id, *row) for row in rows])
+        except BaseException:
+            # Do not leave a solution behind that nothing in the index refers to.
+            os.remove(solution_path)
+            raise
+        if delete:
+            os.remove(ans_path)
+            fem_path = os.path.splitext(ans_path)[0] + '.fem'
+            if os.path.exists(fem_path):
+                os.remove(fem_path)
+        return run_id
+
+    def query(self, model_hash=None, **parameters):
+        """Return the runs matching every given parameter, ordered by id. Each parameter is either a
+        value to match exactly or a ``(low, high)`` tuple to match inclusively. Each run is returned
+        as a dict with its ``id``, ``model_hash``, ``created`` time, ``parameters``, ``scalars`` and
+        ``timings``."""
+
+        sql = 'FROM runs WHERE 1'
+        args = []
+        if model_hash is not None:
+            sql += ' AND model_hash = ?'
+            args.append(model_hash)
+        for name, value in parameters.items():
+            if isinstance(value, tuple):
+                sql += (" AND id IN (SELECT run_id FROM run_values WHERE kind = 'parameter' AND name = ? "
+                        "AND value BETWEEN ? AND ?)")
+                args.extend([name, *value])
+            else:
+                sql += " AND id IN (SELECT run_id FROM run_values WHERE kind = 'parameter' AND name = ? AND value = ?)"
+                args.extend([name, value])
+        runs = {
+            run_id: {'id': run_id, 'model_hash': run_hash, 'created': created, 'parameters': {}, 'scalars': {},
+                     'timings': {}}
+            for run_id, run_hash, created in self.connection.execute(
+                f'SELECT id, model_hash, created {sql} ORDER BY id', args)
+        }
+        for run_id, kind, name, value in self.connection.execute(
+                f'SELECT run_id, kind, name, value FROM run_values WHERE run_id IN (SELECT id {sql})', args):
+            # Runs added since the first query are skipped.
+            if run_id in runs:
+                runs[run_id][f'{kind}s'][name] = value
+        for run in runs.values():
+            for kind in ('parameters', 'scalars', 'timings'):
+                _join_complex(run[kind])
+        return list(runs.values())
+
+    def load(self, run_id):
+        """Load the ``Solution`` of a run."""
+
+        solution_name, = self.connection.execute('SELECT solution FROM runs WHERE id = ?', (run_id,)).fetchone()
+        return Solution.load(os.path.join(self.directory, solution_name))
+
+    def close(self):
+        self.connection.close()
@@ -0,0 +1,263 @@
+"""Surrogate models fitted to scene results, so that new questions about a sweep can be answered
+without running FEMM again.
+
+Three models are available, all with leave-one-out cross validated error estimates at each point:
+
+    – ``RBFSurrogate``: cubic radial basis function interpolation with a linear tail;
+    – ``GaussianProcessSurrogate``: a squared exponential Gaussian process, which also estimates its
+      error at every query point;
+    – ``PolynomialSurrogate``: a Legendre polynomial chaos expansion fitted by least squares.
+
+``AdaptiveSurrogate`` wraps one of these and runs a real solve wherever the estimated error is
+above a tolerance, adding the result to the fit."""
+
+import itertools
+
+import numpy as np
+
+
+def _as_points(x):
+    """Convert a value, a list of values or a list of points into an ``(N, D)`` array."""
+
+    x = np.asarray(x, dtype='float64')
+    if x.ndim == 0:
+        return x.reshape(1, 1)
+    if x.ndim == 1:
+        return x.reshape(-1, 1)
+    return x
+
+
+class BaseSurrogate:
+    """Fits ``y = f(x)`` for points ``x`` of shape ``(N, D)`` and scalar outputs ``y`` of shape ``(N,)``.
+    Inputs are scaled to the unit box and outputs standardised before fitting."""
+
+    neighbours = 3
+
+    def fit(self, x, y):
+        x = _as_points(x)
+        y = np.asarray(y, dtype='float64')
+        self.x = x
+        self.y = y
+        self.x_low = x.min(axis=0)
+        self.x_span = np.where(np.ptp(x, axis=0) > 0, np.ptp(x, axis=0), 1)
+        self.y_mean = y.mean()
+        self.y_scale = y.std() or 1
+        loo_residuals = self._fit(self._scale_x(x), (y - self.y_mean) / self.y_scale)
+        self.cv_residuals = loo_residuals * self.y_scale
+        # Each residual is the error at the distance to the nearest other point, repeated points aside.
+        distances = self._distances(x, x)
+        distances[distances == 0] = np.inf
+        self.cv_rates = np.abs(self.cv_residuals) / distances.min(axis=1)
+        # Zero for interpolating models, but least squares fits do not pass through their data.
+        self.fit_residuals = np.abs(y - self.predict(x))
+        return self
+
+    @property
+    def cv_error(self):
+        """The root mean square leave-one-out cross validation error."""
+
+        return float(np.sqrt(np.mean(self.cv_residuals ** 2)))
+
+    def _scale_x(self, x):
+        return (_as_points(x) - self.x_low) / self.x_span
+
+    def _distances(self, a, b):
+        return np.linalg.norm(self._scale_x(a)[:, None, :] - self._scale_x(b)[None, :, :], axis=2)
+
+    def predict(self, x):
+        return self._predict(self._scale_x(x)) * self.y_scale + self.y_mean
+
+    def error(self, x):
+        """Estimate the error of ``predict`` at each point from the leave-one-out residuals of the
+        ``neighbours`` nearest data points. Each residual is taken per unit distance from the point to
+        its own nearest neighbour, then scaled by the distance to the nearest data point, so the
+        estimate grows away from the data. It is never less than how far the fit misses the nearest
+        data point, which is zero for models that interpolate their data."""
+
+        distances = self._distances(x, self.x)
+        nearest = np.argsort(distances, axis=1)[:, :self.neighbours]
+        nearest_distances = np.take_along_axis(distances, nearest, axis=1)
+        weights = 1 / np.maximum(nearest_distances, 1e-12)
+        rates = np.sqrt(np.sum(weights * self.cv_rates[nearest] ** 2, axis=1) / weights.sum(axis=1))
+        return np.maximum(nearest_distances[:, 0] * rates, self.fit_residuals[nearest[:, 0]])
+
+    def _fit(self, x, y):
+        """Fit the scaled data and return the scaled leave-one-out residuals."""
+
+        raise NotImplementedError('You need to implement this method.')
+
+    def _predict(self, x):
+        raise NotImplementedError('You need to implement this method.')
+
+
+class RBFSurrogate(BaseSurrogate):
+    """Interpolates the data exactly with cubic radial basis functions plus a linear polynomial."""
+
+    def _fit(self, x, y):
+        n, d = x.shape
+        matrix = np.zeros((n + d + 1, n + d + 1))
+        matrix[:n, :n] = self._kernel(x, x)
+        matrix[:n, n:] = np.hstack([np.ones((n, 1)), x])
+        matrix[n:, :n] = matrix[:n, n:].T
+        inverse = np.linalg.pinv(matrix)
+        self.coefficients = inverse @ np.concatenate([y, np.zeros(d + 1)])
+        # Rippa's method gives every leave-one-out residual from a single inverse.
+        return self.coefficients[:n] / np.diag(inverse)[:n]
+
+    @staticmethod
+    def _kernel(a, b):
+        return np.linalg.norm(a[:, None, :] - b[None, :, :], axis=2) ** 3
+
+    def _predict(self, x):
+        n = len(self.x)
+        return (self._kernel(x, self._scale_x(self.x)) @ self.coefficients[:n]
+                + np.hstack([np.ones((len(x), 1)), x]) @ self.coefficients[n:])
+
+
+class GaussianProcessSurrogate(BaseSurrogate):
+    """A Gaussian process with a squared exponential kernel. The length scale is chosen from
+    ``length_scales`` by maximising the marginal likelihood, ``noise`` is the variance of the
+    observation noise relative to the output variance."""
+
+    length_scales = np.logspace(-2, 1, 31)
+    noise = 1e-8
+
+    def _kernel(self, a, b, length_scale):
+        distances = np.sum((a[:, None, :] - b[None, :, :]) ** 2, axis=2)
+        return np.exp(-0.5 * distances / length_scale ** 2)
+
+    def _factorise(self, x, y, length_scale):
+        covariance = self._kernel(x, x, length_scale) + self.noise * np.eye(len(x))
+        cholesky = np.linalg.cholesky(covariance)
+        weights = np.linalg.solve(cholesky.T, np.linalg.solve(cholesky, y))
+        log_likelihood = -0.5 * y @ weights - np.log(np.diag(cholesky)).sum()
+        return cholesky, weights, log_likelihood
+
+    def _fit(self, x, y):
+        best = None
+        for length_scale in self.length_scales:
+            try:
+                cholesky, weights, log_likelihood = self._factorise(x, y, length_scale)
+            except np.linalg.LinAlgError:
+                continue
+            if best is None or log_likelihood > best[3]:
+                best = (length_scale, cholesky, weights, log_likelihood)
+        self.length_scale, self.cholesky, self.weights, _ = best
+        inverse_diagonal = np.sum(np.linalg.inv(self.cholesky) ** 2, axis=0)
+        return self.weights / inverse_diagonal
+
+    def _predict(self, x):
+        return self._kernel(x, self._scale_x(self.x), self.length_scale) @ self.weights
+
+    def error(self, x):
+        """The standard deviation of the prediction at each point."""
+
+        cross = self._kernel(self._scale_x(x), self._scale_x(self.x), self.length_scale)
+        projection = np.linalg.solve(self.cholesky, cross.T)
+        variance = np.clip(1 + self.noise - np.sum(projection ** 2, axis=0), 0, None)
+        return np.sqrt(variance) * self.y_scale
+
+
+class PolynomialSurrogate(BaseSurrogate):
+    """A polynomial chaos expansion in Legendre polynomials up to a total ``degree``,
+    which suits parameters that are uniformly distributed over their range."""
+
+    def __init__(self, degree=4):
+        self.degree = degree
+
+    def _basis(self, x):
+        # Legendre polynomials are orthogonal on [-1, 1].
+        per_dimension = [np.polynomial.legendre.legvander(2 * x[:, i] - 1, self.degree) for i in range(x.shape[1])]
+        return np.stack([
+            np.prod([per_dimension[i][:, power] for i, power in enumerate(powers)], axis=0)
+            for powers in itertools.product(range(self.degree + 1), repeat=x.shape[1])
+            if sum(powers) <= self.degree
+        ], axis=1)
+
+    def _fit(self, x, y):
+        basis = self._basis(x)
+        self.coefficients, *_ = np.linalg.lstsq(basis, y, rcond=None)
+        hat_diagonal = np.sum(basis * (basis @ np.linalg.pinv(basis.T @ basis)), axis=1)
+        residuals = y - basis @ self.coefficients
+        return residuals / np.clip(1 - hat_diagonal, 1e-12, None)
+
+    def _predict(self, x):
+        return self._basis(x) @ self.coefficients
+
+
+class AdaptiveSurrogate:
+    """Answers queries from ``surrogate`` and calls ``solve`` for the points where the estimated
+    error is above ``tolerance``, refitting with the new results before answering. ``solve`` takes
+    an ``(N, D)`` array of points and returns ``N`` outputs, see ``scene_solver``."""
+
+    def __init__(self, surrogate, x, y, solve=None, tolerance=None):
+        self.surrogate = surrogate
+        self.solve = solve
+        self.tolerance = tolerance
+        self.solve_count = 0
+        self.surrogate.fit(x, y)
+
+    @classmethod
+    def from_scene_results(cls, surrogate, results, **kwargs):
+        """Fit to the successful ``SceneResult``s of a scene."""
+
+        succeeded = [result for result in results if result.ok]
+        return cls(surrogate, [result.value for result in succeeded], [result.result for result in succeeded],
+                   **kwargs)
+
+    @classmethod
+    def from_store(cls, surrogate, store, parameter_names, output_name, model_hash=None, **kwargs):
+        """Fit to the runs in a ``ResultStore``, using the parameters in ``parameter_names`` as inputs
+        and the scalar ``output_name`` as the output."""
+
+        runs = [
+            run for run in store.query(model_hash=model_hash)
+            if output_name in run['scalars'] and all(name in run['parameters'] for name in parameter_names)
+        ]
+        x = [[run['parameters'][name] for name in parameter_names] for run in runs]
+        y = [run['scalars'][output_name] for run in runs]
+        return cls(surrogate, x, y, **kwargs)
+
+    def __call__(self, x):
+        """Return the surrogate's prediction at each point."""
+
+        x = _as_points(x)
+        if self.solve is not None and self.tolerance is not None:
+            # Only solve each new point once, points already in the fit are never solved again.
+            new_x = np.unique(x[self.surrogate.error(x) > self.tolerance], axis=0)
+            new_x = new_x[~(new_x[:, None, :] == self.surrogate.x[None, :, :]).all(axis=2).any(axis=1)]
+            if len(new_x):
+                new_y = np.asarray(self.solve(new_x), dtype='float64')
+                self.solve_count += len(new_x)
+                # Leave out any failed solves.
+                new_x, new_y = new_x[np.isfinite(new_y)], new_y[np.isfinite(new_y)]
+                self.surrogate.fit(np.vstack([self.surrogate.x, new_x]), np.concatenate([self.surrogate.y, new_y]))
+        return self.surrogate.predict(x)
+
+    def zeros(self, low, high, resolution=1000):
+        """Find where a surrogate of a single parameter crosses zero between ``low`` and ``high``.
+        Only the zeros found are checked against the tolerance, not the whole range."""
+
+        zeros = self._surrogate_zeros(low, high, resolution)
+        if len(zeros):
+            self(zeros)
+            zeros = self._surrogate_zeros(low, high, resolution)
+        return zeros
+
+    def _surrogate_zeros(self, low, high, resolution):
+        x = np.linspace(low, high, resolution)
+        y = self.surrogate.predict(x)
+        crossings = np.nonzero(np.sign(y[:-1]) != np.sign(y[1:]))[0]
+        # Interpolate linearly between the samples either side of each crossing.
+        return x[crossings] - y[crossings] * (x[crossings + 1] - x[crossings]) / (y[crossings + 1] - y[crossings])
+
+
+def scene_solver(scene_runner):
+    """Return a ``solve`` function for ``AdaptiveSurrogate`` that runs the points through a
+    ``BaseSceneRunner``. Single parameter scenes are given each value, others a tuple."""
+
+    def solve(x):
+        values = x[:, 0] if x.shape[1] == 1 else [tuple(point) for point in x]
+        results = scene_runner.run_jobs(values)
+        return [result.result if result.ok else np.nan for result in results]
+    return solve
@@ -0,0 +1,81 @@
+import os
+import socket
+import threading
+import time
+
+from distributed import JobBroker, run_agents
+from scenes import BaseScene
+
+AUTHKEY = b'test'
+
+
+class FailOnceScene(BaseScene):
+    """Hangs or crashes its agent the first time any agent is given ``hang_value`` or ``crash_value``,
+    and returns every other value. Which values have been seen is kept in ``$FAIL_ONCE_DIRECTORY``."""
+
+    values = [0, 1, 2]
+    hang_value = None
+    crash_value = None
+
+    def _first_time(self, value):
+        try:
+            os.close(os.open(os.path.join(os.environ['FAIL_ONCE_DIRECTORY'], str(value)), os.O_CREAT | os.O_EXCL))
+            return True
+        except FileExistsError:
+            return False
+
+    def run_scene(self, value):
+        if value == self.hang_value and self._first_time(value):
+            time.sleep(60)
+        if value == self.crash_value and self._first_time(value):
+            os._exit(1)
+        return value
+
+    def display_results(self, results):
+        pass
+
+
+def _free_address():
+    with socket.socket() as s:
+        s.bind(('localhost', 0))
+        return 'localhost', s.getsockname()[1]
+
+
+class HangScene(FailOnceScene):
+    hang_value = 1
+
+
+class CrashScene(FailOnceScene):
+    crash_value = 1
+
+
+def _run(scene_class, timeout=None):
+    address = _free_address()
+    broker = JobBroker(scene_class.values, address=address, authkey=AUTHKEY, timeout=timeout, max_retries=1)
+    # Started before the broker listens, so the agents also have to retry their connection.
+    agents = threading.Thread(target=run_agents, args=(scene_class,), daemon=True, kwargs={
+        'address': address, 'authkey': AUTHKEY, 'processes': 1, 'connect_timeout': 10, 'heartbeat_interval': 0.2,
+    })
+    agents.start()
+    results = broker.run()
+    agents.join(timeout=30)
+    assert not agents.is_alive()
+    return results
+
+
+def test_cancelled_job_is_requeued(tmp_path, monkeypatch):
+    monkeypatch.setenv('FAIL_ONCE_DIRECTORY', str(tmp_path))
+    start_time = time.monotonic()
+    results = _run(HangScene, timeout=1)
+    assert [result.result for result in results] == [0, 1, 2]
+    assert results[1].attempts == 2
+    # The hung agent was cancelled rather than left to finish its job.
+    assert time.monotonic() - start_time < 30
+
+
+def test_crashed_agent_is_restarted(tmp_path, monkeypatch):
+    monkeypatch.setenv('FAIL_ONCE_DIRECTORY', str(tmp_path))
+    results = _run(CrashScene)
+    assert [result.result for result in results] == [0, 1, 2]
+    assert results[1].attempts == 2
+    assert results[1].ok
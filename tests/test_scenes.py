@@ -0,0 +1,64 @@
+import os
+import time
+
+from scenes import BaseScene, BaseSceneRunner
+
+HANG, CRASH, RAISE = -1, -2, -3
+
+
+class UnreliableScene(BaseScene):
+    """Hangs, crashes its worker or raises on fixed values and returns every other value."""
+
+    values = [0, 1, 2]
+
+    def run_scene(self, value):
+        if value == HANG:
+            time.sleep(60)
+        if value == CRASH:
+            os._exit(1)
+        if value == RAISE:
+            raise RuntimeError('Simulated FEMM error.')
+        return value
+
+    def display_results(self, results):
+        pass
+
+
+class HangingStartScene(UnreliableScene):
+    """Hangs in ``start_worker`` the first time it is called by any worker."""
+
+    flag_path = None
+
+    def start_worker(self):
+        try:
+            os.close(os.open(self.flag_path, os.O_CREAT | os.O_EXCL))
+        except FileExistsError:
+            return
+        time.sleep(60)
+
+
+def test_timeout_is_retried_then_failed():
+    runner = BaseSceneRunner(UnreliableScene, processes=2, timeout=1, max_retries=1)
+    results = runner.run_jobs([0, HANG, 2])
+    assert [result.result for result in results if result.ok] == [0, 2]
+    assert not results[1].ok
+    assert results[1].error == 'timeout'
+    assert results[1].attempts == 2
+
+
+def test_crashed_and_raising_workers_are_recycled():
+    # A single worker has to be replaced after each failure for the later values to run.
+    runner = BaseSceneRunner(UnreliableScene, processes=1, timeout=10, max_retries=1)
+    results = runner.run_jobs([0, CRASH, 2, RAISE, 4])
+    assert [result.result for result in results if result.ok] == [0, 2, 4]
+    assert results[1].error == 'worker exited with code 1'
+    assert 'Simulated FEMM error.' in results[3].error
+    assert results[1].attempts == results[3].attempts == 2
+
+
+def test_hung_start_does_not_block_other_workers(tmp_path):
+    runner = BaseSceneRunner(HangingStartScene, processes=2, timeout=10, start_timeout=1)
+    runner.scene_class.flag_path = str(tmp_path / 'started')
+    results = runner.run_jobs(range(6))
+    assert all(result.ok for result in results)
+    assert [result.result for result in results] == list(range(6))
@@ -0,0 +1,122 @@
+"""Transports carry command strings from a ``FEMMSession`` to FEMM and return FEMM's response.
+
+    – ``ActiveFEMMTransport``: talks to FEMM over COM, the default;
+    – ``NullTransport``: answers every command with an empty response;
+    – ``RecordingTransport``: passes commands on to another transport, writing each command, its
+      response and how long it took to a trace file;
+    – ``ReplayTransport``: answers commands from a trace file without FEMM, optionally taking as
+      long as FEMM did, so that everything above the wrapper can be run and profiled on any platform.
+
+Trace files have one JSON object per line, e.g. ``{"command": "mi_analyze(0)", "response": "", "latency": 2.1}``."""
+
+import collections
+import json
+import os
+import time
+
+
+class ReplayError(Exception):
+    pass
+
+
+class ActiveFEMMTransport:
+    """Starts a FEMM instance and sends it commands through ``mlab2femm``."""
+
+    def __init__(self):
+        import win32com.client
+        self.femm = win32com.client.Dispatch('femm.ActiveFEMM')
+
+    def mlab2femm(self, command):
+        return self.femm.mlab2femm(command)
+
+
+class NullTransport:
+    """Answers every command with an empty response, to measure the overhead of the wrapper itself."""
+
+    def mlab2femm(self, command):
+        return ''
+
+
+class RecordingTransport:
+    """Records every command sent through ``transport`` to ``path``, which may contain ``{pid}`` so
+    that each worker process writes its own trace."""
+
+    def __init__(self, path, transport=None):
+        self.transport = transport or ActiveFEMMTransport()
+        self.path = path.format(pid=os.getpid())
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.file = open(self.path, 'a')
+
+    def mlab2femm(self, command):
+        start_time = time.perf_counter()
+        try:
+            response = self.transport.mlab2femm(command)
+        except Exception as e:
+            self._write({'command': command, 'error': repr(e), 'latency': time.perf_counter() - start_time})
+            raise
+        self._write({'command': command, 'response': response, 'latency': time.perf_counter() - start_time})
+        return response
+
+    def _write(self, entry):
+        self.file.write(json.dumps(entry) + '\n')
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+class ReplayTransport:
+    """Answers commands with the responses recorded in the trace at ``path``.
+
+    Each command gets the next recorded response to the same command string, so traces can be
+    replayed in a different order. Commands that were not recorded exactly, such as ``saveas`` with
+    another process id in the file name, get the next response recorded for a command of the same
+    name, and the last response is repeated once they run out. With ``use_latency`` each response
+    takes as long as it did when it was recorded, multiplied by ``latency_scale``."""
+
+    def __init__(self, path, use_latency=False, latency_scale=1.0):
+        self.use_latency = use_latency
+        self.latency_scale = latency_scale
+        self.by_command = collections.defaultdict(collections.deque)
+        self.by_name = collections.defaultdict(collections.deque)
+        self.last_by_name = {}
+        with open(path) as f:
+            for line in f:
+                if line.strip():
+                    entry = json.loads(line)
+                    self.by_command[entry['command']].append(entry)
+                    self.by_name[self._name(entry['command'])].append(entry)
+
+    @staticmethod
+    def _name(command):
+        return command.split('(', 1)[0]
+
+    @staticmethod
+    def _pop(entries):
+        # Entries are in both lookups, so skip any already served through the other one.
+        while entries:
+            entry = entries.popleft()
+            if not entry.get('served'):
+                entry['served'] = True
+                return entry
+        return None
+
+    def _next_entry(self, command):
+        name = self._name(command)
+        entry = self._pop(self.by_command[command]) or self._pop(self.by_name[name])
+        if entry is not None:
+            self.last_by_name[name] = entry
+            return entry
+        if name in self.last_by_name:
+            return self.last_by_name[name]
+        raise ReplayError(f'No response was recorded for {command!r}.')
+
+    def mlab2femm(self, command):
+        entry = self._next_entry(command)
+        if self.use_latency:
+            time.sleep(entry['latency'] * self.latency_scale)
+        if 'error' in entry:
+            raise ReplayError(entry['error'])
+        return entry['response']
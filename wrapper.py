@@ -1,12 +1,18 @@
+import inspect
 import os
-import win32com.client
+import time
+from functools import lru_cache, wraps
+
 import numpy as np
 
+from commands import POSTPROCESSOR_COMMANDS, PREPROCESSOR_COMMANDS, add_commands
+from transports import ActiveFEMMTransport
+
 DOCTYPE_MAPPING = {
-    'magnetics': 1,
-    'electrostatics': 2,
-    'heat': 3,
-    'current': 4,
+    'magnetics': 0,
+    'electrostatics': 1,
+    'heat': 2,
+    'current': 3,
 }
 
 DOCTYPE_PREFIX_MAPPING = {
@@ -27,14 +33,61 @@ PREFIX_DOCTYPE_MAPPING = {
     'c': 'current',
 }
 
+# How a session behaves, selected by name with ``FEMMSession(profile=...)``:
+#   – ``skip_view_commands``: drop zoom and plotting commands, they only cost time when nobody is watching;
+#   – ``minimize``: minimize the FEMM window so that it does not redraw;
+#   – ``minimize_analyze``: always run fkern minimized;
+#   – ``record_timings``: total up the time spent in each FEMM command in ``FEMMSession.command_timings``.
+EXECUTION_PROFILES = {
+    'interactive': {
+        'skip_view_commands': False,
+        'minimize': False,
+        'minimize_analyze': False,
+        'record_timings': False,
+    },
+    'batch': {
+        'skip_view_commands': True,
+        'minimize': True,
+        'minimize_analyze': True,
+        'record_timings': False,
+    },
+    'benchmark': {
+        'skip_view_commands': True,
+        'minimize': True,
+        'minimize_analyze': True,
+        'record_timings': True,
+    },
+}
+
+
+def view_command(method):
+    """Mark an API method as only changing the view, so that it is skipped by
+    profiles with ``skip_view_commands``."""
+
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        if self.session.profile['skip_view_commands']:
+            return None
+        return method(self, *args, **kwargs)
+    return wrapper
+
 
 class FEMMSession:
-    """A simple wrapper around FEMM 4.2."""
+    """A simple wrapper around FEMM 4.2. ``profile`` is the name of one of ``EXECUTION_PROFILES``,
+    use ``'batch'`` when nobody is going to look at the FEMM window. Commands are sent through
+    ``transport``, which starts a new FEMM instance over COM by default, see ``transports.py``."""
 
     doctype_prefix = None
-
-    def __init__(self):
-        self.__to_femm = win32com.client.Dispatch('femm.ActiveFEMM')
+    current_directory = None
+    document_path = None
+
+    def __init__(self, profile='interactive', transport=None):
+        self.profile_name = profile
+        self.profile = EXECUTION_PROFILES[profile]
+        self.command_timings = {}
+        self.transport = transport or ActiveFEMMTransport()
+        if self.profile['minimize']:
+            self.call_femm('main_minimize()')
         self.set_current_directory()
         self.pre = PreprocessorAPI(self)
         self.post = PostProcessorAPI(self)
@@ -42,13 +95,34 @@ class FEMMSession:
     def _add_doctype_prefix(self, string):
         return self.doctype_prefix + string
 
+    def _mlab2femm(self, string):
+        if not self.profile['record_timings']:
+            return self.transport.mlab2femm(string)
+        start_time = time.perf_counter()
+        res = self.transport.mlab2femm(string)
+        command_name = string.split('(', 1)[0]
+        self.command_timings[command_name] = self.command_timings.get(command_name, 0) + time.perf_counter() - start_time
+        return res
+
     def call_femm(self, string, add_doctype_prefix=False):
         """Call a given command string using ``mlab2femm``."""
 
         if add_doctype_prefix:
-            res = self.__to_femm.mlab2femm(self._add_doctype_prefix(string))
-        else:
-            res = self.__to_femm.mlab2femm(string)
+            string = self._add_doctype_prefix(string)
+        return self._decode(self._mlab2femm(string))
+
+    def send(self, string, decode=False):
+        """Send a complete command string from one of the encoders in ``commands.py``. Only commands
+        that return values are decoded, the response to any other is just checked for an error."""
+
+        res = self._mlab2femm(string)
+        if decode:
+            return self._decode(res)
+        if res and res[0] == 'e':
+            raise Exception(res)
+
+    @staticmethod
+    def _decode(res):
         if len(res) == 0:
             res = []
         elif res[0] == 'e':
@@ -66,7 +140,7 @@ class FEMMSession:
     def call_femm_noeval(self, string):
         """Call a given command string using ``mlab2femm`` without eval."""
 
-        self.__to_femm(string)
+        self.transport.mlab2femm(string)
 
     def call_femm_with_args(self, command, *args, add_doctype_prefix=True, **kwargs):
         """Call a given command string using ``mlab2femm`` and parse the args."""
@@ -106,6 +180,7 @@ class FEMMSession:
 
         path_of_current_directory = self._fix_path(os.getcwd() if path is None else path)
         self.call_femm(f'setcurrentdirectory({self._quote(path_of_current_directory)})')
+        self.current_directory = path_of_current_directory
 
     def new_document(self, doctype):
         """Creates a new preprocessor document and opens up a new preprocessor window. Specify doctype
@@ -115,6 +190,7 @@ class FEMMSession:
         mode = DOCTYPE_MAPPING[doctype] if isinstance(doctype, str) else doctype
         self.call_femm(f'newdocument({mode})')
         self.set_mode(mode)
+        self.pre.geometry.clear()
 
     def quit(self):
         """Close all documents and exit the the Interactive Shell at the end of
@@ -131,7 +207,11 @@ class FEMMSession:
 
 
 class BaseAPI:
+    """Methods for the commands in ``commands`` are added to subclasses by ``add_commands``, those
+    that need more than their arguments formatting are written out below and use ``_send``."""
+
     mode_prefix = None
+    commands = {}
 
     def __init__(self, session):
         self.session = session
@@ -145,53 +225,158 @@ class BaseAPI:
     def _call_femm_with_args(self, string, *args, **kwargs):
         return self.session.call_femm_with_args(self._add_mode_prefix(string), *args, **kwargs)
 
+    def _send(self, name, *args, **kwargs):
+        command = self.commands[name]
+        return self.session.send(command.encoders[self.session.doctype_prefix](*args, **kwargs), command.decode)
+
+
+@lru_cache(maxsize=None)
+def _takes_i(command):
+    """Whether ``command`` can be given the repeat number ``i`` by ``draw_pattern``."""
+
+    parameters = inspect.signature(command).parameters.values()
+    return any(parameter.name == 'i' or parameter.kind == parameter.VAR_KEYWORD for parameter in parameters)
+
+
+def _as_points(points):
+    """Convert a list of ``[x, y]`` points or an array of them into an ``(N, 2)`` float array."""
+
+    return np.asarray(points, dtype='float64').reshape(-1, 2)
+
+
+class GrowableArray:
+    """An array that rows can be appended to, growing its storage geometrically like a list but
+    without a Python object per row. Single rows are kept in a list until the array is next used,
+    since converting them one at a time costs more than the command they were drawn with.
+    ``array`` is a view of the rows added so far."""
+
+    __slots__ = ('data', 'size', 'pending')
+
+    def __init__(self, row_shape=(), dtype='float64'):
+        self.data = np.empty((64,) + tuple(row_shape), dtype=dtype)
+        self.size = 0
+        self.pending = []
+
+    def __len__(self):
+        return self.size + len(self.pending)
+
+    def append(self, row):
+        """Append a single row and return its index."""
+
+        self.pending.append(row)
+        return len(self) - 1
+
+    def extend(self, rows):
+        """Append an array of rows and return the index of the first."""
+
+        self._flush()
+        start = self.size
+        if start + len(rows) > len(self.data):
+            data = np.empty((max(start + len(rows), 2 * len(self.data)),) + self.data.shape[1:], dtype=self.data.dtype)
+            data[:start] = self.data[:start]
+            self.data = data
+        self.data[start:start + len(rows)] = rows
+        self.size += len(rows)
+        return start
+
+    def _flush(self):
+        if self.pending:
+            pending = self.pending
+            self.pending = []
+            self.extend(pending)
+
+    @property
+    def array(self):
+        self._flush()
+        return self.data[:self.size]
+
+
+class Geometry:
+    """The geometry drawn in the current preprocessor document:
+
+        – ``nodes``: ``(N, 2)`` array of node coordinates, in the order they were added, so that
+          ``PreprocessorAPI.add_segments`` and ``add_arcs`` can refer to nodes by index;
+        – ``segments``: ``(S, 2, 2)`` array of the end points of each segment;
+        – ``arcs``: ``(A, 2, 2)`` array of the end points of each arc segment, with ``arc_angles``;
+        – ``labels``: ``(L, 2)`` array of block label coordinates."""
+
+    __slots__ = ('_nodes', '_segments', '_arcs', '_arc_angles', '_labels')
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self._nodes = GrowableArray((2,))
+        self._segments = GrowableArray((2, 2))
+        self._arcs = GrowableArray((2, 2))
+        self._arc_angles = GrowableArray()
+        self._labels = GrowableArray((2,))
+
+    @property
+    def nodes(self):
+        return self._nodes.array
+
+    @property
+    def segments(self):
+        return self._segments.array
+
+    @property
+    def arcs(self):
+        return self._arcs.array
+
+    @property
+    def arc_angles(self):
+        return self._arc_angles.array
+
+    @property
+    def labels(self):
+        return self._labels.array
+
 
 class PreprocessorAPI(BaseAPI):
-    """Preprocessor API."""
+    """Preprocessor API. Methods that take ``points`` accept a list of ``[x, y]`` points or an
+    ``(N, 2)`` array, and everything drawn is recorded in ``geometry``."""
 
     mode_prefix = 'i'
 
-    def close(self):
-        """Closes current magnetics preprocessor document and
-        destroys magnetics preprocessor window."""
-
-        self._call_femm('close', add_doctype_prefix=True)
+    def __init__(self, session):
+        super().__init__(session)
+        self.geometry = Geometry()
 
     # Utilities
 
     @staticmethod
     def draw_pattern(commands=None, center=None, repeat=None):
-        change_in_angle = (2 * np.pi) / repeat
+        """Call each ``[command, kwargs]`` in ``commands`` ``repeat`` times, rotating ``kwargs['points']``
+        about ``center`` by a further ``2π / repeat`` each time. Commands that take ``i`` are given the
+        number of the repeat. Returns an ``(repeat, P, 2)`` array of the points used for each command."""
+
+        angles = (2 * np.pi) * np.arange(repeat) / repeat
+        cos = np.cos(angles)[:, None]
+        sin = np.sin(angles)[:, None]
+        center = np.asarray(center, dtype='float64')
         ret = []
         for command, kwargs in commands:
-            command_ret = [kwargs['points']]
+            # Look up the function rather than the bound method so that the cache does not keep the session alive.
+            takes_i = _takes_i(getattr(command, '__func__', command))
+            other_kwargs = {key: value for key, value in kwargs.items() if key not in ('points', 'i')}
+            # Rotate every point for every repeat at once.
+            offsets = _as_points(kwargs['points']) - center
+            pattern_points = np.stack([
+                cos * offsets[:, 0] - sin * offsets[:, 1],
+                sin * offsets[:, 0] + cos * offsets[:, 1],
+            ], axis=2) + center
+            pattern_points = np.round(pattern_points, decimals=5)
+            pattern_points[0] = offsets + center
+            rotated_points = pattern_points.tolist()
             for i in range(repeat):
-                if i == 0:
-                    try:
-                        command(i=i, **kwargs)
-                    except TypeError:
-                        command(**kwargs)
+                # The first repeat is drawn from the points exactly as they were given.
+                points = kwargs['points'] if i == 0 else rotated_points[i]
+                if takes_i:
+                    command(points=points, i=i, **other_kwargs)
                 else:
-                    points = kwargs['points']
-                    pattern_angle = change_in_angle * i
-                    rotation_matrix = np.array([[np.cos(pattern_angle), -np.sin(pattern_angle)],
-                                                [np.sin(pattern_angle), np.cos(pattern_angle)]])
-                    # Transform all points to center rotation about the origin.
-                    new_points = [point - np.array(center) for point in points]
-                    # Rotate all points by ``pattern_angle``.
-                    new_points = [np.dot(rotation_matrix, np.array(point).reshape(2, 1)).reshape(2) for point in
-                                  new_points]
-                    # Transform all points back to their original center.
-                    new_points = [point + np.array(center) for point in new_points]
-                    new_points = [np.round(point, decimals=5).tolist() for point in new_points]
-                    command_ret.append(new_points)
-                    try:
-                        command(points=new_points, i=i,
-                                **{key: kwargs[key] for key in kwargs.keys() if not key == 'points'})
-                    except TypeError:
-                        command(points=new_points,
-                                **{key: kwargs[key] for key in kwargs.keys() if not key in ('points', 'i')})
-            ret.append(command_ret)
+                    command(points=points, **other_kwargs)
+            ret.append(pattern_points)
         return ret
 
     # Object Add/Remove Commands
@@ -200,43 +385,111 @@ class PreprocessorAPI(BaseAPI):
         """Add a new node at x, y."""
 
         x, y = points[0]
-        self._call_femm_with_args('addnode', x, y)
+        self._send('addnode', x, y)
+        self.geometry._nodes.append((x, y))
         if group is not None:
             self.select_node(points=points)
             self.set_group(group)
             self.clear_selected()
 
+    def add_nodes(self, xy, group=None):
+        """Add a node at each point of the ``(N, 2)`` array ``xy`` and return their indices
+        into ``geometry.nodes``. All of the nodes are put in ``group`` at once."""
+
+        xy = _as_points(xy)
+        start = self.geometry._nodes.extend(xy)
+        self._send_each('addnode', xy.tolist())
+        if group is not None:
+            # FEMM deselects an object that is selected twice, so select each point only once.
+            self._send_each('selectnode', np.unique(xy, axis=0).tolist())
+            self.set_group(group)
+            self.clear_selected()
+        return np.arange(start, start + len(xy))
+
     def add_segment(self, points=None, group=None):
         """Add a new line segment from node closest to (x1, y1) to node closest to (x2, y2)."""
 
         x1, y1 = points[0]
         x2, y2 = points[1]
-        self._call_femm_with_args('addsegment', x1, y1, x2, y2)
+        self._send('addsegment', x1, y1, x2, y2)
+        self.geometry._segments.append(((x1, y1), (x2, y2)))
         if group is not None:
             self.select_segment(points=points)
             self.set_segment_prop(group=group)
             self.clear_selected()
 
+    def add_segments(self, ij, group=None):
+        """Add a segment between the nodes at each pair of indices into ``geometry.nodes`` in
+        the ``(S, 2)`` array ``ij``, e.g. ``ij = [[0, 1], [1, 2]]``."""
+
+        ends = self.geometry.nodes[np.asarray(ij, dtype='int64').reshape(-1, 2)]
+        self.geometry._segments.extend(ends)
+        self._send_each('addsegment', ends.reshape(-1, 4).tolist())
+        if group is not None:
+            self._send_each('selectsegment', ends.mean(axis=1).tolist())
+            self.set_segment_prop(group=group)
+            self.clear_selected()
+
     def add_block_label(self, points=None, block_name=None, in_circuit=None, i=None, **kwargs):
         """Add a new block label at (x, y)."""
 
         x, y = points[0]
-        self._call_femm_with_args('addblocklabel', x, y)
+        self._send('addblocklabel', x, y)
+        self.geometry._labels.append((x, y))
         if block_name is not None:
             self.select_label(points=points)
             self.set_block_prop(block_name=block_name, in_circuit=in_circuit.format(i=i + 1), **kwargs)
             self.clear_selected()
 
+    def add_block_labels(self, xy, block_name=None, **kwargs):
+        """Add a block label at each point of the ``(N, 2)`` array ``xy``. If ``block_name`` is given
+        the labels are all given the block properties in ``kwargs``, see ``set_block_prop``, at once."""
+
+        xy = _as_points(xy)
+        self.geometry._labels.extend(xy)
+        self._send_each('addblocklabel', xy.tolist())
+        if block_name is not None:
+            self._send_each('selectlabel', np.unique(xy, axis=0).tolist())
+            self.set_block_prop(block_name=block_name, **kwargs)
+            self.clear_selected()
+
     def add_arc(self, points=None, angle=None, max_seg=None, group=None):
         """Add a new arc segment from the nearest node to (x1, y1) to the nearest node to
         (x2, y2) with angle ‘angle’ divided into ‘max_seg’ segments."""
 
-        self._call_femm_with_args('addarc', *points[0], *points[1], angle, max_seg)
+        self._send('addarc', *points[0], *points[1], angle, max_seg)
+        self.geometry._arcs.append((points[0], points[1]))
+        self.geometry._arc_angles.append(angle)
         if group is not None:
             self.select_arc_segment(points=points)
             self.set_group(group)
             self.clear_selected()
 
+    def add_arcs(self, ij, angle=None, max_seg=None, group=None):
+        """Add an arc segment between the nodes at each pair of indices into ``geometry.nodes`` in
+        the ``(A, 2)`` array ``ij``. ``angle`` and ``max_seg`` may be a value for every arc or an
+        array with one for each."""
+
+        ends = self.geometry.nodes[np.asarray(ij, dtype='int64').reshape(-1, 2)]
+        angles = np.broadcast_to(np.asarray(angle, dtype='float64'), len(ends))
+        max_segs = np.broadcast_to(np.asarray(max_seg, dtype='float64'), len(ends))
+        self.geometry._arcs.extend(ends)
+        self.geometry._arc_angles.extend(angles)
+        self._send_each('addarc', np.column_stack([ends.reshape(-1, 4), angles, max_segs]).tolist())
+        if group is not None:
+            self._send_each('selectarcsegment', ends.mean(axis=1).tolist())
+            self.set_group(group)
+            self.clear_selected()
+
+    def _send_each(self, name, rows):
+        """Send the command ``name`` once with the arguments in each row."""
+
+        command = self.commands[name]
+        encode = command.encoders[self.session.doctype_prefix]
+        send = self.session.send
+        for row in rows:
+            send(encode(*row), command.decode)
+
     def draw_line(self, points=None, group=None):
         """Adds nodes at (x1,y1) and (x2,y2) and adds a line between the nodes."""
 
@@ -246,23 +499,18 @@ class PreprocessorAPI(BaseAPI):
 
     def draw_polyline(self, points=None, group=None):
         """Adds nodes at each of the specified points and connects them with segments.
-        ``points`` will look something like [[x1, y1], [x2, y2], ...]"""
+        ``points`` will look something like [[x1, y1], [x2, y2], ...] or an ``(N, 2)`` array."""
 
-        for i, current_point in enumerate(points):
-            # Add each node.
-            self.add_node(points=[current_point], group=group)
-            if 0 < i < len(points):
-                # Draw lines between each node.
-                previous_point = points[i - 1]
-                self.draw_line(points=[previous_point, current_point], group=group)
+        indices = self.add_nodes(points, group=group)
+        self.add_segments(np.column_stack([indices[:-1], indices[1:]]), group=group)
 
     def draw_polygon(self, points=None, group=None):
         """Adds nodes at each of the specified points and connects them with
         segments to form a closed contour."""
 
-        self.draw_polyline(points=points, group=group)
-        # Connect the first and the last nodes.
-        self.draw_line(points=[points[0], points[::-1][0]], group=group)
+        indices = self.add_nodes(points, group=group)
+        # Connect each node to the next, and the last node to the first.
+        self.add_segments(np.column_stack([indices, np.roll(indices, -1)]), group=group)
 
     def draw_arc(self, points=None, angle=None, max_seg=None, group=None):
         """Adds nodes at (x1,y1) and (x2,y2) and adds an arc of the specified
@@ -293,43 +541,11 @@ class PreprocessorAPI(BaseAPI):
         """Adds nodes at the corners of a rectangle defined by the points (x1, y1) and
         (x2, y2), then adds segments connecting the corners of the rectangle."""
 
-        self.draw_line(points=points, group=group)
-        self.draw_line(points=points, group=group)
-        self.draw_line(points=points, group=group)
-        self.draw_line(points=points, group=group)
-
-    def delete_selected(self):
-        """Delete all selected objects."""
-
-        self._call_femm('deleteselected')
-
-    def delete_selected_nodes(self):
-        """Delete selected nodes."""
-
-        self._call_femm('deleteselectednodes')
-
-    def delete_selected_labels(self):
-        """Delete selected labels."""
-
-        self._call_femm('deleteselectedlabels', add_doctype_prefix=True)
-
-    def delete_selected_segments(self):
-        """Delete selected segments."""
-
-        self._call_femm('deleteselectedsegments')
-
-    def delete_selected_arc_segments(self):
-        """Delete selected arc segments."""
-
-        self._call_femm('deleteselectedarcsegments')
+        (x1, y1), (x2, y2) = points[0], points[1]
+        self.draw_polygon(points=[[x1, y1], [x2, y1], [x2, y2], [x1, y2]], group=group)
 
     # Geometry Selection Commands
 
-    def clear_selected(self):
-        """Clear all selected nodes, blocks, segments and arc segments."""
-
-        self._call_femm('clearselected', add_doctype_prefix=True)
-
     def select_segment(self, points=None):
         """Select the line segment closest to (x, y)."""
 
@@ -337,19 +553,19 @@ class PreprocessorAPI(BaseAPI):
         x2, y2 = points[1]
         x_mid = x1 + ((x2 - x1) / 2)
         y_mid = y1 + ((y2 - y1) / 2)
-        self._call_femm_with_args('selectsegment', x_mid, y_mid)
+        self._send('selectsegment', x_mid, y_mid)
 
     def select_node(self, points=None):
         """Select the node closest to (x,y). Returns the coordinates of the selected node."""
 
         x, y = points[0]
-        self._call_femm_with_args('selectnode', x, y, with_eval=False)
+        self._send('selectnode', x, y)
 
     def select_label(self, points=None):
         """Select the label closet to (x,y). Returns the coordinates of the selected label."""
 
         x, y = points[0]
-        self._call_femm_with_args('selectlabel', x, y)
+        self._send('selectlabel', x, y)
 
     def select_arc_segment(self, points=None):
         """Select the arc segment closest to (x, y)."""
@@ -358,75 +574,12 @@ class PreprocessorAPI(BaseAPI):
         x2, y2 = points[1]
         x_mid = x1 + ((x2 - x1) / 2)
         y_mid = y1 + ((y2 - y1) / 2)
-        self._call_femm_with_args('selectarcsegment', x_mid, y_mid)
-
-    def select_group(self, group):
-        """Select the nth group of nodes, segments, arc segments and blocklabels. This
-        function will clear all previously selected elements and leave the editmode in
-        4 (group)."""
-
-        self._call_femm_with_args('selectgroup', group)
-
-    # Object Labeling Commands
-
-    def set_node_prop(self, prop_name=None, group=None):
-        """Set the selected nodes to have the nodal property
-        ``prop_name`` and group ``group``."""
-
-        self._call_femm_with_args('setnodeprop', prop_name, group)
-
-    def set_block_prop(self, block_name=None, auto_mesh=False, mesh_size=None, in_circuit=None, mag_direction=False,
-                       group=None, turns=None):
-        """ Set the selected block labels to have the properties:
-
-            – Block property ``block_name``;
-            – ``auto_mesh``: ``False`` = mesher defers to mesh size constraint defined in ``mesh_size``,
-              ``True`` = mesher automatically chooses the mesh density;
-            – ``mesh_size``: size constraint on the mesh in the block marked by this label;
-            – Block is a member of the circuit named ``in_circuit``;
-            – The magnetization is directed along an angle in measured in degrees denoted by the
-              parameter ``mag_direction``. Alternatively, ``mag_direction`` can be a string containing a
-              formula that prescribes the magnetization direction as a function of element position.
-              In this formula theta and R denotes the angle in degrees of a line connecting the center
-              each element with the origin and the length of this line, respectively; x and y denote
-              the x- and y-position of the center of the each element. For axisymmetric problems, r
-              and z should be used in place of x and y;
-            – A member of group number group;
-            – The number of turns associated with this label is denoted by turns."""
-
-        self._call_femm_with_args('setblockprop', block_name, auto_mesh, mesh_size, in_circuit, mag_direction, group,
-                                  turns)
-
-    def set_segment_prop(self, prop_name=None, element_size=None, auto_mesh=False, hide=False, group=None):
-        """Set the select segments to have:
-
-            – Boundary property ``prop_name``;
-            – Local element size along segment no greater than ``element_size``;
-            – ``auto_mesh``: ``False`` = mesher defers to the element constraint defined by element_size,
-              ``True`` = mesher automatically chooses mesh size along the selected segments;
-            – ``hide``: ``False`` = not hidden in post-processor, ``True`` = hidden in post-processor;
-            – A member of group number group."""
-
-        self._call_femm_with_args('setsegmentprop', prop_name, element_size, auto_mesh, hide, group)
-
-    def set_arc_segment_prop(self, max_seg_deg=None, prop_name=None, hide=None, group=None):
-        """Set the select segments to have:
-            – Boundary property ``prop_name``;
-            – Local element size along segment no greater than ``element_size``;
-            – ``auto_mesh``: ``False`` = mesher defers to the element constraint defined by ``element_size``,
-              ``True`` = mesher automatically chooses mesh size along the selected segments;
-            – ``hide``: ``False`` = not hidden in post-processor, ``True`` == hidden in post-processor;
-            – A member of group number ``group``."""
-
-    def set_group(self, group):
-        """Set the group associated of the selected items to ``group``."""
-
-        self._call_femm_with_args('setgroup', group)
+        self._send('selectarcsegment', x_mid, y_mid)
 
     # Problem Commands
 
     def problem_definition(self, frequency=None, units=None, problem_type=None, precision=None, depth=None,
-                           minimum_angle=None, ac_solver=None):
+                           minimum_angle=None, ac_solver=None, previous_solution=None, time_step=None):
         """Changes the problem definition. Set frequency to the desired frequency in Hertz.
         The units parameter specifies the units used for measuring length in the problem domain.
         Valid "units" entries are "inches", "millimeters", "centimeters", "mils", "meters, and
@@ -436,124 +589,48 @@ class PreprocessorAPI(BaseAPI):
         A fifth parameter, representing the depth of the problem in the into-the-page direction for
         2-D planar problems, can also also be specified. A sixth parameter represents the minimum
         angle constraint sent to the mesh generator. A seventh parameter specifies the solver type to
-        be used for AC problems."""
+        be used for AC problems. Electrostatics problems have no frequency, heat flow problems take
+        the ``previous_solution`` and ``time_step`` of a transient problem instead."""
 
-        self._call_femm_with_args('probdef', frequency, units, problem_type, precision, depth, minimum_angle, ac_solver)
+        self._send('probdef', frequency, units, problem_type, precision, depth, minimum_angle, ac_solver,
+                   previous_solution, time_step)
 
     def analyze(self, minimized=False):
         """Runs fkern to solve the problem. ``minimized`` determines whether or not to
         minmise the fkern window during solving."""
 
-        self._call_femm_with_args('analyze', '1' if minimized else '0')
-
-    def load_solution(self):
-        """Loads and displays the solution corresponding to the current geometry."""
-
-        self._call_femm('loadsolution', add_doctype_prefix=True)
+        minimized = minimized or self.session.profile['minimize_analyze']
+        self._send('analyze', 1 if minimized else 0)
 
     def save_as(self, filename):
         """Saves the file with name "filename". Note if you use a path you
         must use two backslashes e.g. 'c:\\temp\\myfemmfile.fem'."""
 
         parsed_filename = filename.replace('/', '\\')
-        self._call_femm_with_args('saveas', parsed_filename)
-
-    # Mesh Commands
-
-    def create_mesh(self):
-        """Runs triangle to create a mesh. Note that this is not a necessary
-        precursor of performing an analysis, as mi analyze() will make sure
-        the mesh is up to date before running an analysis. The number of
-        elements in the mesh is pushed back onto the lua stack."""
-
-        self._call_femm('createmesh', add_doctype_prefix=True)
-
-    def show_mesh(self):
-        """Shows the mesh."""
-
-        self._call_femm('showmesh', add_doctype_prefix=True)
+        self._send('saveas', parsed_filename)
+        self.session.document_path = os.path.join(self.session.current_directory, filename)
 
-    # Editing Commands
-
-    # Zoom Commands
-
-    def zoom_natural(self):
-        """Zooms to a “natural” view with sensible extents."""
-
-        self._call_femm('zoomnatural', add_doctype_prefix=True)
-
-    def zoom_out(self):
-        """Zoom out by a factor of 50%."""
-
-        self._call_femm('zoomout', add_doctype_prefix=True)
-
-    def zoom_in(self):
-        """Zoom in by a factor of 200%."""
-
-        self._call_femm('zoomin', add_doctype_prefix=True)
-
-    def zoom(self, x1, y1, x2, y2):
-        """Set the display area to be from the bottom left corner specified by
-        (x1, y1) to the top right corner specified by (x2, y2)."""
-
-        self._call_femm_with_args('zoom', x1, y1, x2, y2)
+    @property
+    def solution_path(self):
+        """The path of the solution file written by ``analyze`` for the last saved document."""
 
-    # View Commands
+        return os.path.splitext(self.session.document_path)[0] + '.ans'
 
     # Object Properties
 
-    def get_material(self, material_name):
-        """Fetches the material specified by ``material_name`` from materials library."""
-
-        self._call_femm_with_args('getmaterial', material_name)
-
     def add_material(self, material_name, material_data=None):
-        """Adds a new material with called ``material_name`` with the
-        material properties defined in ``material_data``."""
-
-        self._call_femm_with_args(
-            'addmaterial',
-            material_name,
-            material_data.get('mu_x'),
-            material_data.get('mu_y'),
-            material_data.get('h_c'),
-            material_data.get('j'),
-            material_data.get('c_duct'),
-            material_data.get('lam_d'),
-            material_data.get('phi_hmax'),
-            material_data.get('lam_fill'),
-            material_data.get('lam_type'),
-            material_data.get('phi_hx'),
-            material_data.get('phi_hy'),
-            material_data.get('number_of_strands'),
-            material_data.get('wire_diameter'),
-        )
+        """Adds a new material with called ``material_name`` with the material properties
+        defined in ``material_data``, see the ``addmaterial`` parameters of each mode in
+        ``commands.py``, e.g. ``{'mu_x': 430, 'h_c': 210}`` for magnetics problems."""
+
+        self._send('addmaterial', material_name, **(material_data or {}))
 
     def add_circuit_prop(self, circuit_name=None, current=None, circuit_type=None):
         """Adds a new circuit property with name ``circuit_name`` with a prescribed current. The ``circuit_type``
         parameter is 0 for a parallel-connected circuit and 1 for a series-connected circuit."""
 
         circuit_type_number = 1 if circuit_type == 'series' else 0
-        self._call_femm_with_args('addcircprop', circuit_name, current, circuit_type_number)
-
-    def modify_point_prop(self, point_name=None, prop_number=None, value=None):
-        """This function allows for modification of a point property. The point property to be modified
-        is specified by "PointName". The next parameter is the number of the property to be set. The last
-        number is the value to be applied to the specified property. The various properties that can be
-        modified are listed below: 0: PointName, 1: A or 2: J."""
-
-        self._call_femm_with_args('modifypointprop', point_name, prop_number, value)
-
-    def modify_circuit_prop(self, circuit_name=None, prop_number=None, value=None):
-        """This function allows for modification of a point property. The point property to be modified
-        is specified by "PointName". The next parameter is the number of the property to be set. The last
-        number is the value to be applied to the specified property. The various properties that can be
-        modified are listed below: 0: CircName, 1: i or 2: CircType."""
-
-        self._call_femm_with_args('modifycircprop', circuit_name, prop_number, value)
-
-    def set_current(self, circuit_name=None, current=None):
-        self._call_femm_with_args('setcurrent', circuit_name, current)
+        self._send('addcircprop', circuit_name, current, circuit_type_number)
 
     # Miscellaneous
 
@@ -570,7 +647,7 @@ class PreprocessorAPI(BaseAPI):
             self._call_femm('makeABC', add_doctype_prefix=True)
         else:
             x, y = points[0]
-            self._call_femm_with_args('makeABC', number_of_shells, radius, x, y, boundary_condition_type)
+            self._send('makeABC', number_of_shells, radius, x, y, boundary_condition_type)
 
 
 class PostProcessorAPI(BaseAPI):
@@ -578,49 +655,17 @@ class PostProcessorAPI(BaseAPI):
 
     mode_prefix = 'o'
 
-    def line_integral(self, integral_type):
-        """Calculate the line integral for the defined contour. Returns typically two (possibly
-        complex) values as results. For force and torque results, the 2× results are only relevant
-        for problems where ω 6= 0. The 1× results are only relevant for incremental permeability
-        AC problems. The 1× results represent the force and torque interactions between the
-        steady-state and the incremental AC solution"""
-
-        return self._call_femm_with_args('lineintegral', integral_type)
-
-    def block_integral(self, integral_type):
-        """Calculate a block integral for the selected blocks. This function returns one
-        (possibly complex) value, e.g.: volume = mo_blockintegral(10)."""
-
-        return self._call_femm_with_args('blockintegral', integral_type)
-
-    def get_point_values(self, x, y):
-        """Get the values associated with the point at x,y return values in order"""
-
-        return self._call_femm_with_args('getpointvalues', x, y)
-
     # Selection Commands.
 
-    def set_edit_mode(self, mode):
-        """Sets the mode of the postprocessor to point, contour, or area mode.
-        Valid entries for mode are "point", "contour", and "area"."""
-
-        self._call_femm_with_args('seteditmode', mode)
-
     def select_block(self, points=None):
         """Select the block that contains point (x,y)."""
-        import femm
-        x, y = points[0]
-        self._call_femm_with_args('selectblock', x, y)
-
-    def group_select_block(self, group=None):
-        """Selects all of the blocks that are labeled by block labels that are
-        members of group n. If no number is specified (i.e. mo_groupselectblock()),
-        all blocks are selected."""
 
-        self._call_femm_with_args('groupselectblock', group)
+        x, y = points[0]
+        self._send('selectblock', x, y)
 
     # View Commands.
 
+    @view_command
     def show_density_plot(self, legend=None, grey_scale=None, lower_bound=None, upper_bound=None, plot_type=None):
         """Shows the flux density plot with options:
             – legend Set to 0 to hide the plot legend or 1 to show the plot legend.
@@ -636,7 +681,10 @@ class PostProcessorAPI(BaseAPI):
         If legend is set to -1 all parameters are ignored and default values are used e.g.:
         mo_showdensityplot(-1)."""
 
-        legend_value = ('1' if grey_scale else '0') if not grey_scale == -1 else -1
-        grey_scale_value = '1' if grey_scale else '0'
-        self._call_femm_with_args('showdensityplot', legend_value, grey_scale_value, upper_bound, lower_bound,
-                                  plot_type)
+        legend_value = (1 if grey_scale else 0) if not grey_scale == -1 else -1
+        grey_scale_value = 1 if grey_scale else 0
+        self._send('showdensityplot', legend_value, grey_scale_value, upper_bound, lower_bound, plot_type)
+
+
+add_commands(PreprocessorAPI, PREPROCESSOR_COMMANDS, PreprocessorAPI.mode_prefix)
+add_commands(PostProcessorAPI, POSTPROCESSOR_COMMANDS, PostProcessorAPI.mode_prefix)